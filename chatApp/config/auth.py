@@ -1,13 +1,17 @@
-from datetime import datetime, timedelta
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Any
 
 from fastapi import Depends
 from jose import JWTError, jwt
+from pydantic import ValidationError
 
 from chatApp.config.config import get_settings
 from chatApp.config.logs import logger
 from chatApp.models import user as user_model
 from chatApp.utils import hasher
+from chatApp.utils.cache import TTLCache
 from chatApp.utils.exceptions import credentials_exception
 
 settings = get_settings()
@@ -20,6 +24,13 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 REFRESH_TOKEN_EXPIRE_DAYS = settings.refresh_token_expire_days
 
 
+# Verified token payloads by token digest, each kept until the token expires
+_verified_tokens = TTLCache(
+    maxsize=settings.token_cache_max_entries,
+    ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+)
+
+
 def create_token(
     data: dict[str, Any],
     token_type: str,
@@ -34,100 +45,151 @@ def create_token(
     :return: The encoded JWT token as a string.
     """
     to_encode = data.copy()
+    # jose reads naive datetimes as UTC, so the expiry must be in UTC
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.now() + expires_delta
+        expire = now + expires_delta
     else:
         match token_type:
             case "access":
-                expire = datetime.now() + timedelta(
-                    minutes=ACCESS_TOKEN_EXPIRE_MINUTES
-                )
+                expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
             case "refresh":
-                expire = datetime.now() + timedelta(
-                    days=REFRESH_TOKEN_EXPIRE_DAYS
-                )
-    to_encode.update({"exp": expire})
+                expire = now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire, "type": token_type})
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-def parse_token(token: str) -> dict[str, Any]:
+def _decode(token: str) -> dict[str, Any]:
+    """
+    Verify a JWT token, caching its payload until it expires.
+
+    :raises JWTError: If the token is invalid or expired.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    payload: dict[str, Any] | None = _verified_tokens.get(digest)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        expires_in = payload.get("exp", 0) - time.time()
+        if expires_in > 0:
+            _verified_tokens.set(digest, payload, ttl=expires_in)
+    return payload
+
+
+def decode_token(
+    token: str, token_type: str = "access"
+) -> dict[str, Any] | None:
+    """
+    Verify a JWT token like ``verify_token``, without logging or raising.
+
+    Meant for callers that only peek at tokens the route verifies again,
+    like the rate limiter.
+
+    :return: The payload, or None if the token is invalid, expired or of
+        another type.
+    """
+    try:
+        payload = _decode(token)
+    except JWTError:
+        return None
+    if payload.get("type", "access") != token_type:
+        return None
+    return payload
+
+
+def verify_token(token: str, token_type: str = "access") -> dict[str, Any]:
     """
-    Parse and validate the given JWT token, returning its payload.
+    Verify the signature and expiry of a JWT token and return its payload.
 
-    :param token: The JWT token to parse.
+    Verified payloads are cached by the token's SHA-256 digest until the
+    token expires, so repeated requests with the same token skip the
+    signature check.
+
+    :param token: The JWT token to verify.
+    :param token_type: The expected token type. Tokens issued before the
+        type claim existed are accepted as access tokens only.
     :return: The payload data from the token.
-    :raises credentials_exception: If the token is invalid or cannot be decoded.
+    :raises credentials_exception: If the token is invalid, expired or of
+        another type.
     """
     try:
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"verify_signature": False},
-        )
-        return payload
+        payload = _decode(token)
     except JWTError as e:
-        logger.error(f"JWT error: {e}")  # Log the error for debugging purposes
+        logger.error(f"JWT error: {e}")  # Log the error for debugging
+        raise credentials_exception
+
+    if payload.get("type", "access") != token_type:
+        logger.error(f"Token is not of type {token_type}.")
         raise credentials_exception
+    return payload
+
 
+def token_claims(
+    user: user_model.UserInDB | user_model.UserProfile,
+) -> dict[str, Any]:
+    """Return the user claims carried by access and refresh tokens."""
+    return {
+        "username": user.username,
+        "email": user.email,
+        "id": str(user.id),
+        "is_admin": user.is_admin,
+    }
 
-def validate_token(token: str) -> bool:
+
+async def get_token_user(
+    token: str = Depends(hasher.oauth2_scheme),
+) -> user_model.AuthenticatedUser:
     """
-    Validate the given JWT token by checking its expiration.
+    Build the current user from the claims of the provided JWT token.
+
+    No database lookup is made, so a user deleted after the token was issued
+    is still accepted until it expires. Meant for hot read endpoints, use
+    get_current_user where the user must still exist.
 
-    :param token: The JWT token to validate.
-    :return: True if the token is valid and not expired, otherwise False.
+    :param token: The JWT token used for authentication.
+    :return: The authenticated user described by the token.
+    :raises credentials_exception: If the token is invalid or lacks claims.
     """
+    payload = verify_token(token)
     try:
-        # Decode the token without validating the signature to check expiration
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"verify_signature": False},
-        )
-        # Check if the token is expired
-        if (
-            payload.get("exp")
-            and datetime.fromtimestamp(payload["exp"]) < datetime.now()
-        ):
-            return False
-        return True
-    except JWTError as e:
-        logger.error(f"JWT error: {e}")
-        return False
+        return user_model.AuthenticatedUser(**payload)
+    except ValidationError:
+        logger.error("User claims are missing in the token payload.")
+        raise credentials_exception
 
 
 async def get_current_user(
     token: str = Depends(hasher.oauth2_scheme),
-) -> user_model.UserInDB:
+) -> user_model.AuthenticatedUser:
     """
-    Retrieve the current user from the database using the provided JWT token.
+    Retrieve the current user using the provided JWT token.
+
+    The user is read through the user cache, so most requests make no
+    database query.
 
     :param token: The JWT token used for authentication.
-    :return: The User object representing the authenticated user.
+    :return: The authenticated user.
     :raises credentials_exception: If the user cannot be found or the token is invalid.
     """
     # Parse the token to get the payload
-    payload = parse_token(token)
-    username: str | None = payload.get("username")
+    payload = verify_token(token)
+    user_id: str | None = payload.get("id")
 
-    if username is None:
-        logger.error("Username is missing in the token payload.")
+    if user_id is None:
+        logger.error("User id is missing in the token payload.")
         raise credentials_exception
 
-    user: user_model.UserInDB | None = await user_model.fetch_user_by_username(
-        username
+    user: user_model.UserProfile | None = await user_model.fetch_user_by_id(
+        user_id
     )
 
     # Raise an exception if no user was found
     if user is None:
-        logger.error(f"User with username {username} not found in database.")
+        logger.error(f"User with id {user_id} not found in database.")
         raise credentials_exception
 
-    return user
+    return user_model.AuthenticatedUser.from_user(user)
 
 
 async def authenticate_user(
@@ -138,9 +200,10 @@ async def authenticate_user(
     )
 
     # Return None if no user was found or if password verification fails
-    if user is None or not hasher.verify_password(
+    if user is None or not await hasher.verify_password(
         password, user.hashed_password
     ):
         return None
 
+    await user_model.update_user(str(user.id), {"last_login": datetime.now()})
     return user
@@ -0,0 +1,277 @@
+import asyncio
+import pickle  # nosec B403 - only used for in-process copies
+import time
+import uuid
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from functools import lru_cache
+from typing import Any, TypeGuard
+
+import socketio
+from redis import asyncio as aioredis
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from .config import get_settings
+from .logs import get_logger
+
+logger = get_logger("socket.io")
+settings = get_settings()
+
+REDIS_SCHEMES = ("redis", "rediss", "unix")
+
+
+def is_redis_url(url: str | None) -> TypeGuard[str]:
+    """Whether a URL points to a redis instance."""
+    return url is not None and url.split("://", 1)[0] in REDIS_SCHEMES
+
+
+@lru_cache
+def get_redis(url: str) -> aioredis.Redis:
+    """
+    Return the redis client of a URL.
+
+    Every store configured with the same URL shares the client and its
+    connection pool.
+    """
+    return aioredis.Redis.from_url(url)
+
+
+class LocalPubSubManager(AsyncPubSubManager):
+    """
+    In-process pub/sub client manager.
+
+    Every manager created with the same channel in this process shares the
+    messages, so several ``AsyncServer`` instances can be wired together in
+    tests exactly like separate workers sharing a redis channel.
+    """
+
+    name = "memory"
+    _subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+
+    async def _publish(self, data: Any) -> None:
+        # Round-trip through pickle so receivers never share mutable state
+        # with the sender, like a real broker.
+        payload = pickle.dumps(data)
+        for queue in list(self._subscribers[self.channel]):
+            queue.put_nowait(payload)
+
+    async def _listen(self) -> AsyncIterator[Any]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[self.channel].add(queue)
+        try:
+            while True:
+                yield pickle.loads(await queue.get())  # nosec B301
+        finally:
+            self._subscribers[self.channel].discard(queue)
+
+
+def create_client_manager(
+    url: str | None = None,
+) -> socketio.AsyncManager:
+    """
+    Build the Socket.IO client manager for the configured message queue.
+
+    :param url: The message queue URL, defaults to the settings value.
+    :return: A pub/sub manager when a queue is configured, otherwise the
+        default single-process manager.
+    :raises ValueError: If the URL scheme is not supported.
+    """
+    url = url if url is not None else settings.socketio_message_queue
+    if not url:
+        return socketio.AsyncManager()
+
+    scheme = url.split("://", 1)[0]
+    channel = settings.socketio_channel
+    if scheme == "memory":
+        return LocalPubSubManager(channel=channel, logger=logger)
+    if is_redis_url(url):
+        return socketio.AsyncRedisManager(url, channel=channel, logger=logger)
+    if scheme.startswith("amqp"):
+        return socketio.AsyncAioPikaManager(
+            url, channel=channel, logger=logger
+        )
+    raise ValueError(f"Unsupported socket.io message queue: {url}")
+
+
+class LocalClusterState:
+    """Connection counters kept in this process only."""
+
+    def __init__(self) -> None:
+        self.clients: int = 0
+        self.rooms: dict[str, int] = {}
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def incr_clients(self, delta: int) -> int:
+        self.clients = max(self.clients + delta, 0)
+        return self.clients
+
+    async def incr_room(self, room_id: str, delta: int) -> int:
+        count = max(self.rooms.get(room_id, 0) + delta, 0)
+        if count:
+            self.rooms[room_id] = count
+        else:
+            self.rooms.pop(room_id, None)
+        return count
+
+    async def get_clients(self) -> int:
+        return self.clients
+
+    async def get_room(self, room_id: str) -> int:
+        return self.rooms.get(room_id, 0)
+
+    async def get_rooms(self) -> dict[str, int]:
+        return dict(self.rooms)
+
+
+# Increment a counter of a worker's hash and drop the field once it
+# reaches zero, in one step so the hash never keeps empty rooms. The hash
+# expires with the worker's registration.
+_HINCR_SCRIPT = """
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    count = 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return count
+"""
+
+
+class RedisClusterState:
+    """
+    Connection counters aggregated over every worker in a redis instance.
+
+    Every worker counts its own clients in a hash of its own, which expires
+    unless the worker's heartbeat refreshes it, and readers sum the hashes
+    of the live workers. A worker that shuts down deletes its hash, one
+    that is killed stops being counted once its hash expires, so counts
+    never drift across deploys.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        prefix: str,
+        heartbeat_ttl: float = settings.cluster_state_heartbeat_ttl,
+    ) -> None:
+        self.redis = get_redis(url)
+        self.heartbeat_ttl = heartbeat_ttl
+        self.workers_key = f"{prefix}:workers"
+        self.worker_prefix = f"{prefix}:worker:"
+        self.worker_key = f"{self.worker_prefix}{uuid.uuid4().hex}"
+        self._hincr = self.redis.register_script(_HINCR_SCRIPT)
+        self._heartbeat: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Register this worker and keep its counters alive."""
+        await self._register()
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self) -> None:
+        """Stop counting the clients of this worker."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        await self.redis.zrem(self.workers_key, self.worker_key)
+        await self.redis.delete(self.worker_key)
+
+    async def _register(self) -> None:
+        # Workers are scored with the time their registration expires
+        now = time.time()
+        await self.redis.zadd(
+            self.workers_key, {self.worker_key: now + self.heartbeat_ttl}
+        )
+        await self.redis.pexpire(
+            self.worker_key, int(self.heartbeat_ttl * 1000)
+        )
+        await self.redis.zremrangebyscore(self.workers_key, "-inf", now)
+
+    async def _beat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_ttl / 3)
+            try:
+                await self._register()
+            except Exception as e:
+                logger.error(f"Could not refresh the cluster state: {e}")
+
+    async def _worker_hashes(self, *fields: str) -> list[Any]:
+        """Read fields, or all fields, of the hash of every live worker."""
+        workers = await self.redis.zrangebyscore(
+            self.workers_key, time.time(), "+inf"
+        )
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for worker in workers:
+                if fields:
+                    pipe.hmget(worker, list(fields))
+                else:
+                    pipe.hgetall(worker)
+            return await pipe.execute()
+
+    async def _incr_field(self, field: str, delta: int) -> None:
+        await self._hincr(
+            keys=[self.worker_key],
+            args=[field, delta, int(self.heartbeat_ttl * 1000)],
+        )
+
+    async def incr_clients(self, delta: int) -> int:
+        await self._incr_field("clients", delta)
+        return await self.get_clients()
+
+    async def incr_room(self, room_id: str, delta: int) -> int:
+        await self._incr_field(f"room:{room_id}", delta)
+        return await self.get_room(room_id)
+
+    async def get_clients(self) -> int:
+        hashes = await self._worker_hashes("clients")
+        return max(sum(int(value[0] or 0) for value in hashes), 0)
+
+    async def get_room(self, room_id: str) -> int:
+        hashes = await self._worker_hashes(f"room:{room_id}")
+        return max(sum(int(value[0] or 0) for value in hashes), 0)
+
+    async def get_rooms(self) -> dict[str, int]:
+        rooms: dict[str, int] = defaultdict(int)
+        for fields in await self._worker_hashes():
+            for key, value in fields.items():
+                name = key.decode()
+                if name.startswith("room:"):
+                    rooms[name.removeprefix("room:")] += int(value)
+        return {room: count for room, count in rooms.items() if count > 0}
+
+
+ClusterState = LocalClusterState | RedisClusterState
+
+_local_states: dict[str, LocalClusterState] = {}
+
+
+def create_cluster_state(url: str | None = None) -> ClusterState:
+    """
+    Build the backend holding the cluster-wide connection counters.
+
+    :param url: The state URL, defaults to ``cluster_state_url`` and then to
+        the socket.io message queue URL.
+    :return: A redis backed state for redis URLs, otherwise an in-process
+        one that is shared by every server using the same ``memory://`` URL.
+    """
+    url = url or settings.cluster_state_url or settings.socketio_message_queue
+    if not url:
+        return LocalClusterState()
+
+    if is_redis_url(url):
+        return RedisClusterState(url, settings.cluster_state_prefix)
+    scheme = url.split("://", 1)[0]
+    if scheme != "memory":
+        logger.warning(
+            "No shared store for cluster state with %s, connection counts "
+            "are per worker",
+            scheme,
+        )
+        return LocalClusterState()
+    return _local_states.setdefault(url, LocalClusterState())
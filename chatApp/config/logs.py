@@ -1,8 +1,13 @@
+import atexit
+import itertools
 import logging
-from logging import Logger
-from logging.handlers import RotatingFileHandler
+import queue
+from logging import Logger, LogRecord
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
+from pythonjsonlogger import jsonlogger
+
 from .config import BASE_DIR, get_settings
 
 settings = get_settings()
@@ -17,27 +22,82 @@ except Exception as e:
 
 # Define logging format
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+JSON_LOG_FORMAT = "%(asctime)s %(name)s %(levelname)s %(message)s"
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves all formatting to the listener thread.
+
+    The stock handler formats every record before queueing it. The queue
+    never leaves the process, so records are queued as they are and the
+    message is only built, from its arguments, on the listener thread.
+    """
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through one in every ``1 / rate`` records below ``WARNING``.
+
+    Meant for loggers of hot path events, warnings and errors always pass.
+    """
 
-# Configure the root logger
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.every = max(round(1 / rate), 1) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record: LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if not self.every:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+def _formatter() -> logging.Formatter:
+    if settings.log_json:
+        return jsonlogger.JsonFormatter(JSON_LOG_FORMAT)
+    return logging.Formatter(LOG_FORMAT)
+
+
+# Configure the root logger. Handlers run on the listener thread, so log
+# calls on the event loop never wait for console or file I/O.
 try:
+    formatter = _formatter()
+    handlers: list[logging.Handler] = [
+        logging.StreamHandler(),  # Log to console
+        RotatingFileHandler(
+            log_path,
+            maxBytes=settings.log_max_bytes,
+            backupCount=settings.log_backup_count,
+        ),  # Log to file with rotation
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue[LogRecord] = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
     logging.basicConfig(
         level=settings.log_level.upper(),  # Ensure it's uppercase
-        format=LOG_FORMAT,
-        handlers=[
-            logging.StreamHandler(),  # Log to console
-            RotatingFileHandler(
-                log_path,
-                maxBytes=settings.log_max_bytes,
-                backupCount=settings.log_backup_count,
-            ),  # Log to file with rotation
-        ],
+        handlers=[LazyQueueHandler(log_queue)],
+        force=True,
     )
+    listener.start()
+    # Flush the queue on interpreter exit
+    atexit.register(listener.stop)
 except Exception as e:
     print(f"Error setting up logging: {e}")
     raise
 
 logging.getLogger("passlib").setLevel(logging.ERROR)
 
+for name, rate in settings.log_sample_rates.items():
+    logging.getLogger(name).addFilter(SamplingFilter(rate))
+
 # Get a logger instance
 logger: Logger = logging.getLogger("ChatApp")
 
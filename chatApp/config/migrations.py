@@ -0,0 +1,495 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+)
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from .config import get_settings
+from .schema import apply_schema
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Replaced by the pair_key index, which ignores the member order
+_LEGACY_PRIVATE_ROOM_INDEX = "member1_1_member2_1"
+
+# Replaced by the (room_id, created_at, _id) keyset pagination index
+_LEGACY_MESSAGE_INDEX = "room_id_1_created_at_-1"
+
+# Number of upserts sent to the server per bulk write
+MIGRATION_BATCH_SIZE = 1000
+
+# Embedded arrays in increasing order of precedence, a user listed in
+# several of them ends up with the role of the last one
+_EMBEDDED_ROLES = (
+    ("members", "member"),
+    ("moderators", "moderator"),
+    ("ban_list", "banned"),
+)
+
+
+async def migrate_embedded_memberships(db: AsyncIOMotorDatabase) -> None:
+    """
+    Move public room memberships from embedded arrays to ``room_members``.
+
+    Rooms are migrated one at a time: their members, moderators and bans
+    are upserted into ``room_members``, ``members_count`` is recomputed from
+    the new entries and the arrays are removed. Rooms without arrays are
+    skipped, so the migration is idempotent and resumes where an
+    interrupted run stopped.
+    """
+    rooms_collection = db["public_rooms"]
+    members_collection = db["room_members"]
+
+    cursor = rooms_collection.find(
+        {
+            "$or": [
+                {"members": {"$exists": True}},
+                {"moderators": {"$exists": True}},
+                {"ban_list": {"$exists": True}},
+                {"members_count": {"$exists": False}},
+            ]
+        },
+        {"members": 1, "moderators": 1, "ban_list": 1, "created_at": 1},
+    )
+
+    migrated = 0
+    async for room in cursor:
+        roles = {}
+        for field, role in _EMBEDDED_ROLES:
+            for user_id in room.get(field) or []:
+                roles[user_id] = role
+
+        operations = [
+            UpdateOne(
+                {"room_id": room["_id"], "user_id": user_id},
+                {
+                    "$set": {"role": role},
+                    "$setOnInsert": {
+                        "joined_at": room.get("created_at") or datetime.now()
+                    },
+                },
+                upsert=True,
+            )
+            for user_id, role in roles.items()
+        ]
+        for start in range(0, len(operations), MIGRATION_BATCH_SIZE):
+            await members_collection.bulk_write(
+                operations[start : start + MIGRATION_BATCH_SIZE],
+                ordered=False,
+            )
+
+        members_count = await members_collection.count_documents(
+            {
+                "room_id": room["_id"],
+                "role": {"$in": ["member", "moderator"]},
+            }
+        )
+        await rooms_collection.update_one(
+            {"_id": room["_id"]},
+            {
+                "$set": {"members_count": members_count},
+                "$unset": {"members": "", "moderators": "", "ban_list": ""},
+            },
+        )
+        migrated += 1
+
+    if migrated:
+        logger.info(f"Migrated the memberships of {migrated} public rooms")
+
+
+async def backfill_private_room_pair_keys(db: AsyncIOMotorDatabase) -> None:
+    """
+    Add ``pair_key`` and ``members`` to private rooms created before them.
+
+    The legacy (member1, member2) index let the same pair of users have two
+    rooms, one per member order. Only the oldest of those rooms gets the
+    pair key, the others keep their ``members`` so they are still listed.
+    """
+    rooms_collection = db["private_rooms"]
+
+    try:
+        await rooms_collection.drop_index(_LEGACY_PRIVATE_ROOM_INDEX)
+    except OperationFailure:
+        pass  # Already dropped
+
+    cursor = rooms_collection.find(
+        {"pair_key": {"$exists": False}}, {"member1": 1, "member2": 1}
+    ).sort("_id", 1)
+
+    migrated = 0
+    duplicates = 0
+    async for room in cursor:
+        members = sorted((room["member1"], room["member2"]))
+        await rooms_collection.update_one(
+            {"_id": room["_id"]}, {"$set": {"members": members}}
+        )
+        try:
+            await rooms_collection.update_one(
+                {"_id": room["_id"]},
+                {"$set": {"pair_key": f"{members[0]}:{members[1]}"}},
+            )
+            migrated += 1
+        except DuplicateKeyError:
+            duplicates += 1
+
+    if migrated:
+        logger.info(f"Backfilled the pair keys of {migrated} private rooms")
+    if duplicates:
+        logger.warning(
+            f"{duplicates} private rooms duplicate the pair of another room "
+            "and were left without a pair key"
+        )
+
+
+async def backfill_conversations(db: AsyncIOMotorDatabase) -> None:
+    """
+    Create the room summaries and conversation entries of existing rooms.
+
+    Runs on the first start with the ``conversations`` collection, later
+    summaries and entries are created with rooms and joins. A summary
+    holds the last message of the room's history, and the members of the
+    room start with every message read.
+    """
+    conversations_collection = db["conversations"]
+    if await conversations_collection.find_one({}, {"_id": 1}) is not None:
+        return
+
+    summaries_collection = db["room_summaries"]
+    messages_collection = db["messages"]
+    summaries: list[UpdateOne] = []
+    entries: list[UpdateOne] = []
+
+    async def flush() -> None:
+        if summaries:
+            await summaries_collection.bulk_write(summaries, ordered=False)
+            summaries.clear()
+        if entries:
+            await conversations_collection.bulk_write(entries, ordered=False)
+            entries.clear()
+
+    async def add_room(
+        room: dict,
+        room_type: str,
+        members: list[tuple[ObjectId, datetime | None]],
+    ) -> None:
+        created_at = room.get("created_at") or datetime.now()
+        last = await messages_collection.find_one(
+            {"room_id": room["_id"]},
+            {"user_id": 1, "content": 1, "created_at": 1},
+            sort=[("created_at", -1), ("_id", -1)],
+        )
+        summary: dict = {"last_message": None, "last_message_at": created_at}
+        if last is not None:
+            content = last.get("content")
+            summary = {
+                "last_message": {
+                    "id": last["_id"],
+                    "user_id": last["user_id"],
+                    "preview": (
+                        content[: settings.conversation_preview_length]
+                        if content is not None
+                        else None
+                    ),
+                    "created_at": last["created_at"],
+                },
+                "last_message_at": last["created_at"],
+            }
+        summaries.append(
+            UpdateOne(
+                {"_id": room["_id"]}, {"$setOnInsert": summary}, upsert=True
+            )
+        )
+        entries.extend(
+            UpdateOne(
+                {"room_id": room["_id"], "user_id": user_id},
+                {
+                    "$setOnInsert": {
+                        "room_type": room_type,
+                        "joined_at": joined_at or created_at,
+                        "last_read_at": summary["last_message_at"],
+                    }
+                },
+                upsert=True,
+            )
+            for user_id, joined_at in members
+        )
+        if len(entries) >= MIGRATION_BATCH_SIZE:
+            await flush()
+
+    rooms = 0
+    async for room in db["private_rooms"].find(
+        {}, {"member1": 1, "member2": 1, "created_at": 1}
+    ):
+        await add_room(
+            room, "private", [(room["member1"], None), (room["member2"], None)]
+        )
+        rooms += 1
+
+    members_collection = db["room_members"]
+    async for room in db["public_rooms"].find({}, {"created_at": 1}):
+        members = [
+            (member["user_id"], member.get("joined_at"))
+            async for member in members_collection.find(
+                {
+                    "room_id": room["_id"],
+                    "role": {"$in": ["member", "moderator"]},
+                },
+                {"user_id": 1, "joined_at": 1},
+            )
+        ]
+        await add_room(room, "public", members)
+        rooms += 1
+
+    await flush()
+    if rooms:
+        logger.info(f"Created the conversation entries of {rooms} rooms")
+
+
+async def drop_legacy_message_index(db: AsyncIOMotorDatabase) -> None:
+    """
+    Drop the (room_id, created_at) messages index.
+
+    The keyset pagination index starts with the same keys, so the legacy
+    one only made every message insert maintain a second index.
+    """
+    try:
+        await db["messages"].drop_index(_LEGACY_MESSAGE_INDEX)
+        logger.info(f"Dropped the legacy index {_LEGACY_MESSAGE_INDEX}")
+    except OperationFailure:
+        pass  # Already dropped
+
+
+async def recount_public_room_members(db: AsyncIOMotorDatabase) -> None:
+    """
+    Recompute ``members_count`` of every public room from ``room_members``.
+
+    Repairs counters left off by joins interrupted between their two
+    writes. Rooms are counted a batch at a time and only rooms whose
+    counter is off are updated. Append it again to repair new drift.
+    """
+    rooms_collection = db["public_rooms"]
+    members_collection = db["room_members"]
+
+    cursor = rooms_collection.find({}, {"members_count": 1})
+    repaired = 0
+    while rooms := await cursor.to_list(length=MIGRATION_BATCH_SIZE):
+        counts = {
+            count["_id"]: count["count"]
+            async for count in members_collection.aggregate(
+                [
+                    {
+                        "$match": {
+                            "room_id": {
+                                "$in": [room["_id"] for room in rooms]
+                            },
+                            "role": {"$in": ["member", "moderator"]},
+                        }
+                    },
+                    {"$group": {"_id": "$room_id", "count": {"$sum": 1}}},
+                ]
+            )
+        }
+        operations = [
+            UpdateOne(
+                {"_id": room["_id"]},
+                {"$set": {"members_count": counts.get(room["_id"], 0)}},
+            )
+            for room in rooms
+            if room.get("members_count") != counts.get(room["_id"], 0)
+        ]
+        if operations:
+            await rooms_collection.bulk_write(operations, ordered=False)
+            repaired += len(operations)
+
+    if repaired:
+        logger.info(f"Repaired the members count of {repaired} public rooms")
+
+
+async def lowercase_usernames(db: AsyncIOMotorDatabase) -> None:
+    """
+    Lowercase the usernames of users registered before they were normalized.
+
+    Usernames are looked up lowercased only. A username whose lowercase is
+    already taken by another user is left as it is and reported, these
+    users can't log in until one of them is renamed.
+    """
+    users_collection = db["users"]
+
+    renamed = 0
+    async for user in users_collection.find({}, {"username": 1}):
+        username = user["username"]
+        if username == username.lower():
+            continue
+        try:
+            await users_collection.update_one(
+                {"_id": user["_id"]}, {"$set": {"username": username.lower()}}
+            )
+            renamed += 1
+        except DuplicateKeyError:
+            logger.warning(
+                f"Username {username} of user {user['_id']} collides with "
+                f"another user once lowercased, rename one of them"
+            )
+
+    if renamed:
+        logger.info(f"Lowercased the usernames of {renamed} users")
+
+
+Migration = Callable[[AsyncIOMotorDatabase], Awaitable[None]]
+
+# Applied in order, the schema version is the number of migrations
+# applied. Only ever append: after changing a validator or an index,
+# append apply_schema again.
+MIGRATIONS: list[Migration] = [
+    apply_schema,
+    migrate_embedded_memberships,
+    backfill_private_room_pair_keys,
+    backfill_conversations,
+    drop_legacy_message_index,
+    recount_public_room_members,
+    lowercase_usernames,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Collection and id of the document holding the version and the lease
+SCHEMA_COLLECTION = "schema_version"
+SCHEMA_DOCUMENT_ID = "schema"
+
+# Seconds between checks of a worker waiting for another one to migrate
+SCHEMA_LEASE_POLL_INTERVAL = 1.0
+
+
+async def bootstrap_schema(
+    db: AsyncIOMotorDatabase,
+    lease_seconds: float = settings.schema_lease_seconds,
+) -> None:
+    """
+    Bring the database up to ``SCHEMA_VERSION``.
+
+    An up to date database costs a single read. Otherwise one worker takes
+    the lease on the version document and applies the pending migrations,
+    recording the version after each one, while the other workers wait for
+    it. The lease is renewed while migrating, the lease of a worker that
+    died expires after ``lease_seconds`` and another worker resumes.
+
+    :raises RuntimeError: If the lease was taken over while migrating.
+    """
+    collection = db[SCHEMA_COLLECTION]
+    owner = ObjectId()
+
+    while True:
+        version = await _schema_version(collection)
+        if version >= SCHEMA_VERSION:
+            return
+        if await _acquire_lease(collection, owner, lease_seconds):
+            break
+        logger.info("Waiting for another worker to migrate the schema")
+        await asyncio.sleep(SCHEMA_LEASE_POLL_INTERVAL)
+
+    renewal = asyncio.create_task(
+        _renew_lease(collection, owner, lease_seconds)
+    )
+    try:
+        # Another worker may have finished before the lease was taken
+        version = await _schema_version(collection)
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            migration = MIGRATIONS[number - 1]
+            logger.info(
+                f"Applying schema migration {number}: {migration.__name__}"
+            )
+            await migration(db)
+            result = await collection.update_one(
+                {"_id": SCHEMA_DOCUMENT_ID, "lease_owner": owner},
+                {"$set": {"version": number, "updated_at": datetime.now()}},
+            )
+            if result.matched_count == 0:
+                raise RuntimeError("Lost the schema migration lease")
+        logger.info(f"Database schema is at version {SCHEMA_VERSION}")
+    finally:
+        renewal.cancel()
+        await asyncio.gather(renewal, return_exceptions=True)
+        await collection.update_one(
+            {"_id": SCHEMA_DOCUMENT_ID, "lease_owner": owner},
+            {"$unset": {"lease_owner": "", "lease_expires_at": ""}},
+        )
+
+
+async def _schema_version(collection: AsyncIOMotorCollection) -> int:
+    document = await collection.find_one(
+        {"_id": SCHEMA_DOCUMENT_ID}, {"version": 1}
+    )
+    return document.get("version", 0) if document else 0
+
+
+def _lease_expiry(lease_seconds: float) -> list[dict]:
+    # On the server clock, so workers on other hosts agree on expiry
+    return [
+        {
+            "$set": {
+                "lease_expires_at": {
+                    "$add": ["$$NOW", int(lease_seconds * 1000)]
+                }
+            }
+        }
+    ]
+
+
+async def _acquire_lease(
+    collection: AsyncIOMotorCollection, owner: ObjectId, lease_seconds: float
+) -> bool:
+    """Take the lease unless another worker holds an unexpired one."""
+    try:
+        await collection.update_one(
+            {"_id": SCHEMA_DOCUMENT_ID},
+            {"$setOnInsert": {"version": 0}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        pass  # Created by another worker at the same time
+
+    result = await collection.update_one(
+        {
+            "_id": SCHEMA_DOCUMENT_ID,
+            # A missing expiry compares lower than any date
+            "$expr": {"$lte": ["$lease_expires_at", "$$NOW"]},
+        },
+        [{"$set": {"lease_owner": owner}}, *_lease_expiry(lease_seconds)],
+    )
+    return result.modified_count == 1
+
+
+async def _renew_lease(
+    collection: AsyncIOMotorCollection, owner: ObjectId, lease_seconds: float
+) -> None:
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        await collection.update_one(
+            {"_id": SCHEMA_DOCUMENT_ID, "lease_owner": owner},
+            _lease_expiry(lease_seconds),
+        )
+
+
+async def migrate() -> None:
+    """Bring the configured database up to ``SCHEMA_VERSION`` and exit."""
+    client: AsyncIOMotorClient = AsyncIOMotorClient(settings.database_url)
+    try:
+        await bootstrap_schema(client[settings.database_name])
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    # Out of band migrations for workers started with --skip-bootstrap:
+    # python -m chatApp.config.migrations
+    from . import logs  # noqa: F401, sets up logging
+
+    asyncio.run(migrate())
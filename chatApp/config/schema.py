@@ -0,0 +1,205 @@
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+USER_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["username", "email", "hashed_password"],
+        "properties": {
+            "username": {"bsonType": "string"},
+            "email": {"bsonType": "string"},
+            "hashed_password": {"bsonType": "string"},
+            "is_active": {"bsonType": "bool"},
+            "is_admin": {"bsonType": "bool"},
+            "created_at": {"bsonType": "date"},
+            "updated_at": {"bsonType": "date"},
+            "last_login": {"bsonType": "date"},
+        },
+    }
+}
+
+MESSAGE_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["user_id", "room_id", "room_type"],
+        "properties": {
+            "user_id": {"bsonType": "objectId"},
+            "room_id": {"bsonType": "objectId"},
+            "room_type": {"bsonType": "string"},
+            "content": {"bsonType": "string"},
+            "media": {"bsonType": "string"},
+            "created_at": {"bsonType": "date"},
+        },
+    }
+}
+
+PUBLIC_ROOM_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["owner", "name"],
+        "properties": {
+            "owner": {"bsonType": "objectId"},
+            "name": {"bsonType": "string"},
+            "description": {"bsonType": "string"},
+            "max_members": {"bsonType": "int"},
+            "welcome_message": {"bsonType": "string"},
+            "rules": {"bsonType": "string"},
+            "allow_file_sharing": {"bsonType": "bool"},
+            "members_count": {"bsonType": "int"},
+            "allow_users_access_message_history": {"bsonType": "bool"},
+            "max_latest_messages_access": {"bsonType": "int"},
+            "created_at": {"bsonType": "date"},
+        },
+    }
+}
+
+PRIVATE_ROOM_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["member1", "member2"],
+        "properties": {
+            "member1": {"bsonType": "objectId"},
+            "member2": {"bsonType": "objectId"},
+            "pair_key": {"bsonType": "string"},
+            "members": {
+                "bsonType": "array",
+                "items": {"bsonType": "objectId"},
+            },
+            "created_at": {"bsonType": "date"},
+        },
+    }
+}
+
+ROOM_MEMBER_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["room_id", "user_id", "role"],
+        "properties": {
+            "room_id": {"bsonType": "objectId"},
+            "user_id": {"bsonType": "objectId"},
+            "role": {"enum": ["member", "moderator", "banned"]},
+            "joined_at": {"bsonType": "date"},
+        },
+    }
+}
+
+CONVERSATION_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": [
+            "user_id",
+            "room_id",
+            "room_type",
+            "joined_at",
+            "last_read_at",
+        ],
+        "properties": {
+            "user_id": {"bsonType": "objectId"},
+            "room_id": {"bsonType": "objectId"},
+            "room_type": {"bsonType": "string"},
+            "joined_at": {"bsonType": "date"},
+            "last_read_at": {"bsonType": "date"},
+        },
+    }
+}
+
+# Keyed by room ID
+ROOM_SUMMARY_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": ["last_message", "last_message_at"],
+        "properties": {
+            "last_message": {"bsonType": ["object", "null"]},
+            "last_message_at": {"bsonType": "date"},
+        },
+    }
+}
+
+# Validator of each collection
+COLLECTION_VALIDATORS = {
+    "users": USER_SCHEMA,
+    "messages": MESSAGE_SCHEMA,
+    "public_rooms": PUBLIC_ROOM_SCHEMA,
+    "private_rooms": PRIVATE_ROOM_SCHEMA,
+    "room_members": ROOM_MEMBER_SCHEMA,
+    "conversations": CONVERSATION_SCHEMA,
+    "room_summaries": ROOM_SUMMARY_SCHEMA,
+}
+
+# Indexes of each collection
+COLLECTION_INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "messages": [
+        # Serves the keyset pagination of a room's history, the
+        # _id suffix breaks ties between equal timestamps
+        IndexModel(
+            [
+                ("room_id", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        IndexModel([("room_type", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "public_rooms": [IndexModel([("name", ASCENDING)], unique=True)],
+    "private_rooms": [
+        # One room per pair of users, whatever the member order.
+        # Partial so rooms waiting for the backfill don't clash.
+        IndexModel(
+            [("pair_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"pair_key": {"$exists": True}},
+        ),
+        # The private rooms of a user, in either member position
+        IndexModel([("members", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "room_members": [
+        # Membership checks and the member list of a room
+        IndexModel(
+            [("room_id", ASCENDING), ("user_id", ASCENDING)],
+            unique=True,
+        ),
+        # The rooms of a user
+        IndexModel([("user_id", ASCENDING), ("room_id", ASCENDING)]),
+    ],
+    "conversations": [
+        # Read positions of the senders and mark as read
+        IndexModel(
+            [("room_id", ASCENDING), ("user_id", ASCENDING)],
+            unique=True,
+        ),
+        # The rooms of a user
+        IndexModel([("user_id", ASCENDING), ("room_id", ASCENDING)]),
+    ],
+    "room_summaries": [
+        # The keyset pagination of a user's conversations
+        IndexModel([("last_message_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+}
+
+
+async def apply_schema(db: AsyncIOMotorDatabase) -> None:
+    """
+    Create the collections and indexes, and update existing validators.
+
+    Existing collections get their validator replaced with ``collMod``,
+    indexes that already exist with the same options are left as they are.
+    """
+    for name, validator in COLLECTION_VALIDATORS.items():
+        try:
+            await db.create_collection(name, validator=validator)
+            logger.info(f"Created collection '{name}'")
+        except CollectionInvalid:
+            await db.command("collMod", name, validator=validator)
+            logger.info(f"Updated the validator of collection '{name}'")
+
+    for name, indexes in COLLECTION_INDEXES.items():
+        await db[name].create_indexes(indexes)
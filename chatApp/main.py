@@ -1,3 +1,4 @@
+import asyncio
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 
@@ -5,12 +6,26 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import PlainTextResponse
 
 from chatApp.config.config import get_settings
-from chatApp.config.database import init_mongo_db, shutdown_mongo_db
-from chatApp.middlewares.request_limit import RequestLimitMiddleware
+from chatApp.config.database import (
+    get_room_members_collection,
+    init_mongo_db,
+    shutdown_mongo_db,
+)
+from chatApp.middlewares.metrics import MetricsMiddleware
+from chatApp.middlewares.rate_limit import RateLimitMiddleware
+from chatApp.middlewares.request_scope import RequestScopeMiddleware
+from chatApp.models import public_room
+from chatApp.models.membership import watch_invalidations
 from chatApp.routes import auth, chat, user
-from chatApp.sockets import sio_app
+from chatApp.services.message_writer import (
+    init_message_writer,
+    shutdown_message_writer,
+)
+from chatApp.services.metrics import registry
+from chatApp.sockets import global_state, presence, sio_app
 
 # Fetch settings
 settings = get_settings()
@@ -20,9 +35,33 @@ settings = get_settings()
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     # This function will be called on startup and shutdown
     await init_mongo_db(test_db=settings.test_mode)
+    await init_message_writer()
+
+    background_tasks: list[asyncio.Task] = []
+    if settings.membership_change_streams:
+        background_tasks.append(
+            asyncio.create_task(
+                watch_invalidations(
+                    get_room_members_collection(),
+                    public_room.membership_index.apply_change,
+                    public_room.membership_index.clear,
+                )
+            )
+        )
+
+    await global_state.start()
+    presence.start()
+
     try:
         yield
     finally:
+        await presence.stop()
+        await global_state.stop()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        # Drain queued messages while the database is still reachable
+        await shutdown_message_writer()
         await shutdown_mongo_db()
 
 
@@ -35,6 +74,8 @@ app = FastAPI(
 )
 
 ### Add middlewares ###
+# Innermost, memoizes user and room lookups for the rest of the request
+app.add_middleware(RequestScopeMiddleware)
 # Configure CORS using settings
 app.add_middleware(
     CORSMiddleware,
@@ -43,7 +84,11 @@ app.add_middleware(
     allow_methods=settings.cors_allow_methods,
     allow_headers=settings.cors_allow_headers,
 )
-app.add_middleware(RequestLimitMiddleware, max_requests=10, window_seconds=1)
+if settings.rate_limit_enabled:
+    app.add_middleware(RateLimitMiddleware)
+if settings.metrics_enabled:
+    # Outside the rate limiter, so rejected requests are measured too
+    app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     TrustedHostMiddleware,
     allowed_hosts=settings.trusted_hosts,
@@ -60,6 +105,16 @@ async def root() -> dict[str, str]:
     return {"message": "Welcome to the FastAPI Chat App"}
 
 
+if settings.metrics_enabled:
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> PlainTextResponse:
+        return PlainTextResponse(
+            await registry.render(),
+            media_type="text/plain; version=0.0.4",
+        )
+
+
 # Mount socket.io app
 app.mount("/socket.io/", app=sio_app)
 
@@ -0,0 +1,51 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from chatApp.services.metrics import http_request_duration
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording HTTP latency per route template.
+
+    Routes are labelled with their path template, so path parameters do not
+    grow the label set, mounted apps with their mount path and requests
+    matching no route as ``unmatched``.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the shared scope
+            route = scope.get("route")
+            template = (
+                route.path
+                if route is not None
+                else scope.get("root_path") or "unmatched"
+            )
+            http_request_duration.observe(
+                time.perf_counter() - start_time,
+                scope["method"],
+                template,
+                str(status_code),
+            )
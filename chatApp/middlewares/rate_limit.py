@@ -0,0 +1,256 @@
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from chatApp.config.auth import decode_token
+from chatApp.config.cluster import get_redis, is_redis_url
+from chatApp.config.config import get_settings
+from chatApp.config.logs import get_logger
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+# Bucket capacity and refill rate in tokens per second
+Rule = tuple[float, float]
+
+
+def parse_rule(value: str) -> Rule:
+    """
+    Parse a ``"<requests>/<seconds>"`` limit into a token bucket rule.
+
+    :raises ValueError: If the limit is malformed.
+    """
+    requests, _, seconds = value.partition("/")
+    capacity = float(requests)
+    period = float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit: {value}")
+    return capacity, capacity / period
+
+
+class LocalRateLimitBackend:
+    """
+    Token buckets of one worker.
+
+    The table is LRU bounded, an evicted bucket starts over full, which is
+    what an idle bucket would have refilled to anyway.
+    """
+
+    def __init__(
+        self, max_entries: int = settings.rate_limit_max_entries
+    ) -> None:
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def hit(self, key: str, rule: Rule) -> float:
+        """
+        Take a token from a bucket.
+
+        :return: 0 if the request is allowed, otherwise the seconds until
+            the bucket holds a token again.
+        """
+        capacity, rate = rule
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+# Refill and take a token in one step, on the redis clock so every worker
+# agrees. Buckets expire once they would be full again.
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared by every worker in a redis instance."""
+
+    def __init__(self, url: str, prefix: str) -> None:
+        self.redis = get_redis(url)
+        self.prefix = prefix
+        self._hit = self.redis.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def hit(self, key: str, rule: Rule) -> float:
+        capacity, rate = rule
+        retry_after = await self._hit(
+            keys=[f"{self.prefix}:ratelimit:{key}"], args=[capacity, rate]
+        )
+        return float(retry_after)
+
+
+RateLimitBackend = LocalRateLimitBackend | RedisRateLimitBackend
+
+
+def create_rate_limit_backend(url: str | None = None) -> RateLimitBackend:
+    """
+    Build the backend holding the token buckets.
+
+    :param url: The redis URL, defaults to ``rate_limit_url`` and then to
+        the cluster state and socket.io message queue URLs.
+    :return: A redis backed store for redis URLs, otherwise a per worker one.
+    """
+    url = (
+        url
+        or settings.rate_limit_url
+        or settings.cluster_state_url
+        or settings.socketio_message_queue
+    )
+    if is_redis_url(url):
+        return RedisRateLimitBackend(url, settings.cluster_state_prefix)
+    return LocalRateLimitBackend()
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI token bucket rate limiter.
+
+    Requests with a valid access token are limited per user, others per
+    client IP. Exact paths can add stricter limits on top. Rejected
+    requests get a 429 with a Retry-After header, allowed ones an
+    X-Process-Time header. Websocket connections are not limited. When
+    the backend fails, requests are let through rather than rejected.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: RateLimitBackend | None = None,
+        default_limit: str = settings.rate_limit_default,
+        user_limit: str = settings.rate_limit_user,
+        route_limits: Mapping[str, str] = settings.rate_limit_routes,
+        exempt_paths: Iterable[str] = settings.rate_limit_exempt_paths,
+        trusted_proxies: Iterable[str] = settings.trusted_proxies,
+    ) -> None:
+        self.app = app
+        self.backend = backend or create_rate_limit_backend()
+        self.default_rule = parse_rule(default_limit)
+        self.user_rule = parse_rule(user_limit)
+        self.route_rules = {
+            path: parse_rule(limit) for path, limit in route_limits.items()
+        }
+        self.exempt_paths = tuple(exempt_paths)
+        self.trusted_proxies = [
+            ipaddress.ip_network(proxy, strict=False)
+            for proxy in trusted_proxies
+        ]
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(
+            self.exempt_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        client, rule = self.identify(scope, headers)
+        limits = [(client, rule)]
+        route_rule = self.route_rules.get(scope["path"])
+        if route_rule is not None:
+            limits.append((f"{scope['path']}:{client}", route_rule))
+        for key, limit in limits:
+            try:
+                retry_after = await self.backend.hit(key, limit)
+            except Exception as e:
+                logger.error("Rate limit backend failed: %s", e)
+                break
+            if retry_after > 0:
+                logger.warning(
+                    "Too many requests from %s on %s", client, scope["path"]
+                )
+                response = PlainTextResponse(
+                    "Too many requests",
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+                await response(scope, receive, send)
+                return
+
+        start_time = time.perf_counter()
+
+        async def send_with_process_time(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                MutableHeaders(scope=message).append(
+                    "X-Process-Time", str(process_time)
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_process_time)
+
+    def identify(self, scope: Scope, headers: Headers) -> tuple[str, Rule]:
+        """Return the bucket key of the client and its limit."""
+        authorization = headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token:
+            # Verified payloads are cached, so this is usually a lookup. The
+            # route verifies the token again and logs failures.
+            payload = decode_token(token)
+            user_id = payload.get("id") if payload is not None else None
+            if user_id:
+                return f"user:{user_id}", self.user_rule
+        return f"ip:{self.client_ip(scope, headers)}", self.default_rule
+
+    def client_ip(self, scope: Scope, headers: Headers) -> str:
+        """
+        Return the address of the client.
+
+        X-Forwarded-For is only read when the peer is a trusted proxy, and
+        then from the right, the first untrusted hop is the client.
+        """
+        client = scope.get("client")
+        host = client[0] if client else "unknown"
+        if not self.is_trusted(host):
+            return host
+
+        hops = [
+            hop.strip()
+            for hop in headers.get("x-forwarded-for", "").split(",")
+            if hop.strip()
+        ]
+        for hop in reversed(hops):
+            if not self.is_trusted(hop):
+                return hop
+            host = hop
+        return host
+
+    def is_trusted(self, host: str) -> bool:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
@@ -0,0 +1,25 @@
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from chatApp.utils.cache import request_scope
+
+
+class RequestScopeMiddleware:
+    """
+    Pure ASGI middleware memoizing cache lookups per HTTP request.
+
+    Websocket connections live for hours and are left out, their values
+    would never be refreshed.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with request_scope():
+            await self.app(scope, receive, send)
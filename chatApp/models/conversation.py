@@ -0,0 +1,296 @@
+from collections.abc import Iterable, Mapping
+from datetime import datetime
+from typing import Any
+
+from bson import ObjectId
+from pydantic import BaseModel, Field
+from pymongo import DESCENDING, UpdateOne
+
+from chatApp.config.config import get_settings
+from chatApp.config.database import (
+    get_conversations_collection,
+    get_room_summaries_collection,
+)
+from chatApp.utils.object_id import PydanticObjectId
+from chatApp.utils.pagination import decode_cursor, encode_cursor
+
+settings = get_settings()
+
+
+class LastMessage(BaseModel):
+    id: PydanticObjectId
+    user_id: PydanticObjectId
+    preview: str | None = Field(
+        default=None, description="Start of the message content"
+    )
+    created_at: datetime
+
+
+class Conversation(BaseModel):
+    user_id: PydanticObjectId
+    room_id: PydanticObjectId
+    room_type: str
+    joined_at: datetime = Field(default_factory=lambda: datetime.now())
+    last_read_at: datetime = Field(
+        default_factory=lambda: datetime.now(),
+        description="Messages up to this time are read",
+    )
+
+
+class ConversationInDB(Conversation):
+    id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
+
+
+class ConversationView(ConversationInDB):
+    """A conversation with its room's last message and its unread count."""
+
+    last_message: LastMessage | None = Field(default=None)
+    last_message_at: datetime = Field(
+        description="Time of the last message, or of the room's creation",
+    )
+    unread_count: int = Field(
+        default=0, description="Capped at the conversation_unread_cap"
+    )
+
+
+ConversationPage = tuple[list[ConversationView], str | None]
+
+
+def _preview(content: str | None) -> str | None:
+    if content is None:
+        return None
+    return content[: settings.conversation_preview_length]
+
+
+async def add_room_summary(room_id: ObjectId, created_at: datetime) -> None:
+    """Create the summary of a new room, ordered by its creation time."""
+    await get_room_summaries_collection().update_one(
+        {"_id": room_id},
+        {
+            "$setOnInsert": {
+                "last_message": None,
+                "last_message_at": created_at,
+            }
+        },
+        upsert=True,
+    )
+
+
+async def add_conversations(
+    room_id: ObjectId, room_type: str, user_ids: Iterable[ObjectId]
+) -> None:
+    """Create the conversation entries of users that joined a room."""
+    conversations_collection = get_conversations_collection()
+    operations = [
+        UpdateOne(
+            {"room_id": room_id, "user_id": user_id},
+            {
+                "$setOnInsert": Conversation(
+                    user_id=user_id, room_id=room_id, room_type=room_type
+                ).model_dump(exclude={"room_id", "user_id"})
+            },
+            upsert=True,
+        )
+        for user_id in user_ids
+    ]
+    if operations:
+        await conversations_collection.bulk_write(operations, ordered=False)
+
+
+async def record_messages(messages: Iterable[Mapping[str, Any]]) -> None:
+    """
+    Apply a batch of written messages to the room summaries.
+
+    Nothing is written per member: every room of the batch costs one update
+    of its summary and one per sender, whose read position moves to their
+    own last message. Unread counts are computed when the conversations
+    are read.
+
+    :param messages: The message documents, in creation order.
+    """
+    rooms: dict[ObjectId, list[Mapping[str, Any]]] = {}
+    for message in messages:
+        rooms.setdefault(message["room_id"], []).append(message)
+
+    summaries: list[UpdateOne] = []
+    read_positions: list[UpdateOne] = []
+    for room_id, room_messages in rooms.items():
+        last = room_messages[-1]
+        last_message = {
+            "id": last["_id"],
+            "user_id": last["user_id"],
+            "preview": _preview(last.get("content")),
+            "created_at": last["created_at"],
+        }
+        # Batches of several workers may arrive out of order, only a newer
+        # message replaces the summary
+        newer = {"$gt": [last["created_at"], "$last_message_at"]}
+        summaries.append(
+            UpdateOne(
+                {"_id": room_id},
+                [
+                    {
+                        "$set": {
+                            "last_message": {
+                                "$cond": [
+                                    newer,
+                                    {"$literal": last_message},
+                                    "$last_message",
+                                ]
+                            },
+                            "last_message_at": {
+                                "$max": [
+                                    "$last_message_at",
+                                    last["created_at"],
+                                ]
+                            },
+                        }
+                    }
+                ],
+                upsert=True,
+            )
+        )
+
+        # Sending a message reads the room up to that message
+        sent: dict[ObjectId, datetime] = {}
+        for message in room_messages:
+            sent[message["user_id"]] = message["created_at"]
+        read_positions += [
+            UpdateOne(
+                {"room_id": room_id, "user_id": user_id},
+                {"$max": {"last_read_at": created_at}},
+            )
+            for user_id, created_at in sent.items()
+        ]
+
+    if summaries:
+        await get_room_summaries_collection().bulk_write(
+            summaries, ordered=False
+        )
+    if read_positions:
+        await get_conversations_collection().bulk_write(
+            read_positions, ordered=False
+        )
+
+
+def _before(last_message_at: datetime, room_id: ObjectId) -> dict[str, Any]:
+    return {
+        "$or": [
+            {"last_message_at": {"$lt": last_message_at}},
+            {"last_message_at": last_message_at, "_id": {"$lt": room_id}},
+        ]
+    }
+
+
+async def fetch_conversations(
+    user_id: str, before: str | None = None, limit: int = 50
+) -> ConversationPage:
+    """
+    Fetch a page of a user's conversations, most recent first.
+
+    The page is one keyset query on the summaries of the user's rooms,
+    whose IDs are read from the ``(user_id, room_id)`` index alone. The
+    entries of the page are then read in one aggregation, which counts
+    their unread messages on the ``(room_id, created_at, _id)`` messages
+    index, up to ``conversation_unread_cap``.
+
+    :param user_id: The user ID.
+    :param before: The next_cursor of the previous page.
+    :param limit: Maximum number of conversations to return.
+    :return: The conversations and the cursor of the next page.
+    :raises ValueError: If the cursor is malformed.
+    """
+    position = decode_cursor(before) if before is not None else None
+    user_id_obj = PydanticObjectId(user_id)
+
+    conversations_collection = get_conversations_collection()
+    room_ids = await conversations_collection.distinct(
+        "room_id", {"user_id": user_id_obj}
+    )
+    if not room_ids:
+        return [], None
+
+    query: dict[str, Any] = {"_id": {"$in": room_ids}}
+    if position is not None:
+        query.update(_before(*position))
+    summaries = (
+        await get_room_summaries_collection()
+        .find(query)
+        .sort([("last_message_at", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit)
+        .to_list(length=limit)
+    )
+    if not summaries:
+        return [], None
+
+    entries = {
+        entry["room_id"]: entry
+        async for entry in conversations_collection.aggregate(
+            [
+                {
+                    "$match": {
+                        "user_id": user_id_obj,
+                        "room_id": {
+                            "$in": [summary["_id"] for summary in summaries]
+                        },
+                    }
+                },
+                {
+                    "$lookup": {
+                        "from": "messages",
+                        "localField": "room_id",
+                        "foreignField": "room_id",
+                        "let": {"last_read_at": "$last_read_at"},
+                        "pipeline": [
+                            {
+                                "$match": {
+                                    "$expr": {
+                                        "$gt": [
+                                            "$created_at",
+                                            "$$last_read_at",
+                                        ]
+                                    }
+                                }
+                            },
+                            {"$limit": settings.conversation_unread_cap},
+                            {"$project": {"_id": 1}},
+                        ],
+                        "as": "unread",
+                    }
+                },
+                {"$set": {"unread_count": {"$size": "$unread"}}},
+                {"$unset": "unread"},
+            ]
+        )
+    }
+
+    conversations = [
+        ConversationView(
+            **entries[summary["_id"]],
+            last_message=summary["last_message"],
+            last_message_at=summary["last_message_at"],
+        )
+        for summary in summaries
+    ]
+    next_cursor = None
+    if len(summaries) == limit:
+        last = summaries[-1]
+        next_cursor = encode_cursor(last["last_message_at"], last["_id"])
+    return conversations, next_cursor
+
+
+async def mark_conversation_read(room_id: str, user_id: str) -> bool:
+    """
+    Mark every message of a user's conversation as read.
+
+    :return: Whether the user has a conversation in the room.
+    """
+    conversations_collection = get_conversations_collection()
+    result = await conversations_collection.update_one(
+        {
+            "room_id": PydanticObjectId(room_id),
+            "user_id": PydanticObjectId(user_id),
+        },
+        {"$max": {"last_read_at": datetime.now()}},
+    )
+    return result.matched_count == 1
@@ -0,0 +1,183 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any
+
+from bson import ObjectId
+
+from chatApp.config.config import get_settings
+from chatApp.config.logs import get_logger
+from chatApp.utils.cache import TTLCache
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+
+class RoomMembership:
+    """Hash set of the members of one room."""
+
+    __slots__ = ("members",)
+
+    def __init__(self, members: Iterable[ObjectId] = ()) -> None:
+        self.members: set[ObjectId] = set(members)
+
+    def is_member(self, user_id: ObjectId) -> bool:
+        return user_id in self.members
+
+
+Loader = Callable[[ObjectId], Awaitable[RoomMembership | None]]
+
+
+class MembershipIndex:
+    """
+    Lazily filled, LRU bounded cache of room memberships.
+
+    Meant for rooms whose members never change once the room is created,
+    like private rooms, so entries only leave the cache when they expire
+    after ``ttl`` seconds or are evicted.
+    """
+
+    def __init__(
+        self,
+        loader: Loader,
+        max_rooms: int = settings.membership_index_max_rooms,
+        ttl: float = settings.membership_index_ttl,
+    ) -> None:
+        self.loader = loader
+        self._rooms = TTLCache(maxsize=max_rooms, ttl=ttl)
+
+    async def get(self, room_id: ObjectId) -> RoomMembership | None:
+        """
+        Return the membership of a room, loading it on a miss.
+
+        :param room_id: The room ID.
+        :return: The room membership, or None if the room does not exist.
+        """
+        membership = self._rooms.get(room_id)
+        if membership is not None:
+            return membership
+
+        membership = await self.loader(room_id)
+        if membership is not None:
+            self._rooms.set(room_id, membership)
+        return membership
+
+    def clear(self) -> None:
+        self._rooms.clear()
+
+
+_MISSING = object()
+
+RoleLoader = Callable[[ObjectId, ObjectId], Awaitable[str | None]]
+
+
+class MemberRoleIndex:
+    """
+    Lazily filled, LRU bounded cache of single memberships.
+
+    Maps ``(room_id, user_id)`` to the user's role in the room, or None when
+    the user has no membership, so rooms of any size only cache the users
+    that were actually looked up. Writes must update or invalidate entries.
+
+    Writes of other workers are picked up once entries expire. No
+    membership expires after ``negative_ttl`` seconds, so a user who just
+    joined through another worker is let in quickly, roles after ``ttl``.
+    """
+
+    def __init__(
+        self,
+        loader: RoleLoader,
+        max_entries: int = settings.membership_index_max_entries,
+        ttl: float = settings.membership_index_ttl,
+        negative_ttl: float = settings.membership_index_negative_ttl,
+    ) -> None:
+        self.loader = loader
+        self.negative_ttl = negative_ttl
+        self._roles = TTLCache(maxsize=max_entries, ttl=ttl)
+        # Keys of the memberships seen in change events, by membership _id
+        self._keys = TTLCache(maxsize=max_entries, ttl=ttl)
+
+    async def get(self, room_id: ObjectId, user_id: ObjectId) -> str | None:
+        role = self._roles.get((room_id, user_id), _MISSING)
+        if role is not _MISSING:
+            return role
+
+        role = await self.loader(room_id, user_id)
+        self.set(room_id, user_id, role)
+        return role
+
+    def set(
+        self, room_id: ObjectId, user_id: ObjectId, role: str | None
+    ) -> None:
+        """Record a role, None for no membership, written by this process."""
+        self._roles.set(
+            (room_id, user_id),
+            role,
+            ttl=self.negative_ttl if role is None else None,
+        )
+
+    def invalidate(self, room_id: ObjectId, user_id: ObjectId) -> None:
+        self._roles.pop((room_id, user_id))
+
+    def apply_change(self, change: dict[str, Any]) -> None:
+        """
+        Update the index from a change event of the memberships collection.
+
+        Delete events only carry the membership's ``_id``, which is mapped
+        back to its entry from the earlier events of the membership, like
+        the insert of a join rolled back because the room was full. Only a
+        delete of a membership no event was seen for clears the index.
+        """
+        member = change.get("fullDocument")
+        if member is not None:
+            key = (member["room_id"], member["user_id"])
+            self._keys.set(member["_id"], key)
+            self.set(*key, member["role"])
+            return
+
+        member_id = change.get("documentKey", {}).get("_id")
+        key = self._keys.pop(member_id) if member_id is not None else None
+        if key is None:
+            self.clear()
+        else:
+            self.invalidate(*key)
+
+    def clear(self) -> None:
+        self._roles.clear()
+
+
+async def watch_invalidations(
+    collection: Any,
+    on_change: Callable[[dict[str, Any]], None],
+    on_reset: Callable[[], None],
+) -> None:
+    """
+    Invalidate index entries from a collection's change stream.
+
+    Keeps the indexes of every worker in sync with writes made elsewhere.
+    Change streams need a replica set, so this runs only when
+    ``membership_change_streams`` is enabled.
+
+    :param on_change: Called with every change event.
+    :param on_reset: Called whenever the stream (re)starts, entries loaded
+        while it was down may be stale.
+    """
+    retry_delay = 1
+    while True:
+        try:
+            async with collection.watch(
+                full_document="updateLookup"
+            ) as stream:
+                on_reset()
+                retry_delay = 1
+                async for change in stream:
+                    on_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(
+                "Membership change stream failed, retrying in %ds: %s",
+                retry_delay,
+                e,
+            )
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 60)
@@ -1,11 +1,25 @@
+from collections.abc import AsyncIterator
 from datetime import datetime
+from typing import Any
 
+import orjson
+from bson import ObjectId
 from pydantic import BaseModel, Field
+from pymongo import ASCENDING, DESCENDING
 
+from chatApp.config.config import get_settings
 from chatApp.config.database import get_messages_collection
-from chatApp.utils.object_id import PydanticObjectId
+from chatApp.config.logs import get_logger
+from chatApp.services.message_writer import get_message_writer
+from chatApp.utils.object_id import PydanticObjectId, is_valid_object_id
+from chatApp.utils.pagination import decode_cursor, encode_cursor
 
 from . import private_room, public_room
+from .conversation import record_messages
+from .recent_messages import recent_messages
+
+logger = get_logger(__name__)
+settings = get_settings()
 
 
 class Message(BaseModel):
@@ -21,91 +35,369 @@ class MessageInDB(Message):
     id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
 
 
-async def get_public_messages(room_id: str) -> list[MessageInDB]:
+MessagePage = tuple[list[MessageInDB], str | None]
+
+
+async def _resolve_cursor(value: str) -> tuple[datetime, ObjectId | None]:
+    """
+    Turn a ``before``/``after`` value into a keyset position.
+
+    The value can be a message ID, a cursor token from a previous page or an
+    ISO 8601 timestamp.
+
+    :raises ValueError: If the value is none of these.
+    """
+    if is_valid_object_id(value):
+        messages_collection = get_messages_collection()
+        message = await messages_collection.find_one(
+            {"_id": ObjectId(value)}, {"created_at": 1}
+        )
+        if message is None:
+            raise ValueError(f"Message {value} not found")
+        return message["created_at"], message["_id"]
+
+    try:
+        return decode_cursor(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value), None
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {value}") from None
+
+
+async def _history_boundary(
+    room_id: str, max_messages: int
+) -> tuple[datetime, ObjectId] | None:
     """
-    Fetch public messages from a specific room.
+    Find the oldest message among the latest ``max_messages`` of a room.
+
+    The query projects only indexed fields so it is answered from the
+    ``(room_id, created_at, _id)`` index without reading any message.
+    ``room_type`` is left out of the filter for that reason, room ids are
+    unique across both room collections.
+
+    :return: The position of that message, or None if the room has fewer
+        messages.
     """
     messages_collection = get_messages_collection()
+    cursor = (
+        messages_collection.find(
+            {"room_id": PydanticObjectId(room_id)},
+            {"_id": 1, "created_at": 1},
+        )
+        .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+        .skip(max_messages - 1)
+        .limit(1)
+    )
+    boundary = await cursor.to_list(length=1)
+    if not boundary:
+        return None
+    return boundary[0]["created_at"], boundary[0]["_id"]
+
 
-    # Fetch the public room by ID
-    room = await public_room.fetch_public_room_by_id(room_id)
-    if room is None:
-        return []
+def _keyset_filter(
+    created_at: datetime, id: ObjectId | None, operator: str
+) -> dict[str, Any]:
+    if id is None:
+        return {"created_at": {operator: created_at}}
+    return {
+        "$or": [
+            {"created_at": {operator: created_at}},
+            {"created_at": created_at, "_id": {operator: id}},
+        ]
+    }
 
+
+def _lower_bound_filter(created_at: datetime, id: ObjectId) -> dict[str, Any]:
+    """Match the messages at or after a keyset position."""
+    return {
+        "$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gte": id}},
+        ]
+    }
+
+
+async def _get_room_messages(
+    room_id: str,
+    room_type: str,
+    before: str | None,
+    after: str | None,
+    limit: int,
+    max_messages: int | None = None,
+) -> MessagePage:
+    """
+    Fetch one page of a room's messages, newest first.
+
+    Pages are selected with a keyset on ``(created_at, _id)`` so the query
+    walks the ``(room_id, created_at, _id)`` index instead of skipping
+    documents. The returned cursor continues in the same direction: pass it
+    as ``before`` when paging back in history, or as ``after`` when paging
+    forward from an ``after`` query.
+
+    ``max_messages`` restricts the readable history to the latest messages
+    of the room, older messages are excluded by the query itself.
+    """
     room_id_obj = PydanticObjectId(room_id)
-    query = {"room_id": room_id_obj, "room_type": "public"}
+    if max_messages is not None:
+        if max_messages <= 0:
+            return [], None
+        limit = min(limit, max_messages)
+
+    before_position = after_position = None
+    if before is not None:
+        before_position = await _resolve_cursor(before)
+    elif after is not None:
+        after_position = await _resolve_cursor(after)
+
+    use_cache = recent_messages.enabled
+    lower_bound: tuple[datetime, ObjectId] | None = None
+    if max_messages is not None:
+        known = False
+        if use_cache:
+            known, lower_bound = recent_messages.boundary(
+                room_id_obj, max_messages
+            )
+        if not known:
+            lower_bound = await _history_boundary(room_id, max_messages)
+
+    if use_cache:
+        page = recent_messages.get_page(
+            room_id_obj, limit, before_position, after_position, lower_bound
+        )
+        if page is not None:
+            return page
+
+    conditions: list[dict[str, Any]] = [
+        {"room_id": room_id_obj, "room_type": room_type}
+    ]
+    if lower_bound is not None:
+        conditions.append(_lower_bound_filter(*lower_bound))
+
+    direction = DESCENDING
+    if before_position is not None:
+        conditions.append(_keyset_filter(*before_position, "$lt"))
+    elif after_position is not None:
+        conditions.append(_keyset_filter(*after_position, "$gt"))
+        direction = ASCENDING
 
-    # Fetch the documents using the query
-    cursor = messages_collection.find(query)
+    query = conditions[0] if len(conditions) == 1 else {"$and": conditions}
 
-    # Convert the cursor to a list and await the result
-    messages = await cursor.to_list(length=None)
+    # A read of the latest page seeds the room's recent messages buffer
+    generation = (
+        recent_messages.begin_read(room_id_obj)
+        if use_cache and before is None and after is None
+        else None
+    )
+    try:
+        messages_collection = get_messages_collection()
+        cursor = (
+            messages_collection.find(query)
+            .sort([("created_at", direction), ("_id", direction)])
+            .limit(limit)
+        )
+        messages = await cursor.to_list(length=limit)
+
+        next_cursor = None
+        if len(messages) == limit:
+            last = messages[-1]
+            next_cursor = encode_cursor(last["created_at"], last["_id"])
+        if direction == ASCENDING:
+            messages.reverse()
+
+        page_messages = [MessageInDB(**message) for message in messages]
+        if generation is not None:
+            recent_messages.seed(
+                room_id_obj,
+                page_messages,
+                complete=len(messages) < limit and lower_bound is None,
+                generation=generation,
+            )
+    finally:
+        if generation is not None:
+            recent_messages.end_read(room_id_obj)
+    return page_messages, next_cursor
+
+
+async def get_public_messages(
+    room: public_room.PublicRoomInDB,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = settings.messages_page_size,
+) -> MessagePage:
+    """
+    Fetch a page of public messages from a specific room.
+
+    The room's history settings are enforced here: rooms that disallow
+    history return nothing without querying, and rooms capped to their
+    latest messages never read past the cap.
+    """
+    if not room.allow_users_access_message_history:
+        return [], None
 
-    # Convert each document to MessageInDB
-    return [MessageInDB(**message) for message in messages]
+    return await _get_room_messages(
+        str(room.id),
+        "public",
+        before,
+        after,
+        limit,
+        max_messages=room.max_latest_messages_access,
+    )
 
 
 async def get_private_messages(
-    room_id: str,
-) -> list[MessageInDB]:
+    room: private_room.PrivateRoomInDB,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = settings.messages_page_size,
+) -> MessagePage:
     """
-    Fetch private messages from a specific room between two users.
+    Fetch a page of private messages from a specific room between two users.
     """
-    # Fetch the private room by ID
-    room_id_obj = PydanticObjectId(room_id)
-    room = await private_room.fetch_private_room_by_id(room_id)
-    if room is None:
-        return []
+    return await _get_room_messages(
+        str(room.id), "private", before, after, limit
+    )
 
-    messages_collection = get_messages_collection()
-    query = {"room_id": room_id_obj, "room_type": "private"}
 
-    # Fetch the documents using the query
-    cursor = messages_collection.find(query)
+# Fields written by the export, `_id` is renamed to `id` like in the API
+EXPORT_PROJECTION = {
+    "_id": 1,
+    "user_id": 1,
+    "room_id": 1,
+    "room_type": 1,
+    "content": 1,
+    "media": 1,
+    "created_at": 1,
+}
 
-    # Convert the cursor to a list and await the result
-    messages = await cursor.to_list(length=None)
 
-    # Convert each document to MessageInDB
-    return [MessageInDB(**message) for message in messages]
+async def export_room_messages(
+    room_id: str,
+    room_type: str,
+    after: str | None = None,
+    max_messages: int | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    Stream a room's messages, oldest first, as NDJSON chunks.
+
+    Documents are read from the cursor in batches and serialized straight to
+    JSON with orjson, without building a model per message, so memory use
+    does not depend on the size of the room.
+
+    :param after: Only export messages after this message ID, cursor or
+        timestamp, for incremental backfills.
+    :param max_messages: Only export the latest messages of the room.
+    :raises ValueError: If ``after`` is not a valid position.
+    """
+    conditions: list[dict[str, Any]] = [
+        {"room_id": PydanticObjectId(room_id), "room_type": room_type}
+    ]
+    if max_messages is not None:
+        if max_messages <= 0:
+            return
+        lower_bound = await _history_boundary(room_id, max_messages)
+        if lower_bound is not None:
+            conditions.append(_lower_bound_filter(*lower_bound))
+    if after is not None:
+        conditions.append(_keyset_filter(*await _resolve_cursor(after), "$gt"))
+    query = conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    messages_collection = get_messages_collection()
+    cursor = messages_collection.find(
+        query,
+        EXPORT_PROJECTION,
+        batch_size=settings.messages_export_batch_size,
+    ).sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+
+    chunk = bytearray()
+    async for document in cursor:
+        document["id"] = document.pop("_id")
+        chunk += orjson.dumps(
+            document, default=str, option=orjson.OPT_APPEND_NEWLINE
+        )
+        if len(chunk) >= settings.messages_export_chunk_size:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
 
 
 async def create_message(
-    room_id: str, user_id: str, room_type: str, content: str
-):
+    room_id: str,
+    user_id: str,
+    room_type: str,
+    content: str,
+    durable: bool | None = None,
+    verify_room: bool = True,
+) -> MessageInDB:
     """
     Create a new message in the specified room.
+
+    The message goes through the write-behind writer when it is running,
+    ``durable`` chooses whether to wait for the batch to be written. Callers
+    that already authorized the room, like the socket handlers, pass
+    ``verify_room=False`` to skip the room lookup.
     """
-    room: private_room.PrivateRoomInDB | public_room.PublicRoomInDB | None = (
-        None
-    )
-    if room_type == "private":
-        room = await private_room.fetch_private_room_by_id(room_id)
-    else:
-        room = await public_room.fetch_public_room_by_id(room_id)
+    if verify_room:
+        room: (
+            private_room.PrivateRoomInDB | public_room.PublicRoomInDB | None
+        ) = None
+        if room_type == "private":
+            room = await private_room.fetch_private_room_by_id(room_id)
+        else:
+            room = await public_room.fetch_public_room_by_id(room_id)
 
-    if room is None:
-        raise ValueError("Room not found")
+        if room is None:
+            raise ValueError("Room not found")
 
     messages_collection = get_messages_collection()
     room_id_obj = PydanticObjectId(room_id)
     user_id_obj = PydanticObjectId(user_id)
 
+    # BSON dates have millisecond precision, truncate so the message equals
+    # the stored one, which the recent messages buffer relies on
+    created_at = datetime.now()
+    created_at = created_at.replace(
+        microsecond=created_at.microsecond // 1000 * 1000
+    )
     message = Message(
         user_id=user_id_obj,
         room_id=room_id_obj,
         room_type=room_type,
         content=content,
-        created_at=datetime.now(),
+        created_at=created_at,
     )
 
     message_dict = message.model_dump(by_alias=True)
+    # Generate the `_id` here so the message can be queued and still be
+    # returned with its final id
+    message_dict["_id"] = ObjectId()
+    new_message = MessageInDB(**message_dict)
+
+    # Buffer the message before any await so buffers stay in creation order
+    if recent_messages.enabled:
+        recent_messages.append(new_message)
+
+    # Queued messages are reported as written by the writer once stored
+    writer = get_message_writer()
+    try:
+        if writer is not None:
+            await writer.submit(message_dict, durable=durable)
+        else:
+            await messages_collection.insert_one(message_dict)
+    except BaseException:
+        # The buffer may hold a message that was never stored
+        recent_messages.invalidate(room_id_obj)
+        recent_messages.written(room_id_obj, new_message.id)
+        raise
+    if writer is None:
+        recent_messages.written(room_id_obj, new_message.id)
 
-    # Add the `_id` to the dictionary
-    result = await messages_collection.insert_one(message_dict)
-    message_dict["_id"] = (
-        result.inserted_id
-    )  # Add the _id field to the dictionary
+    if writer is None:
+        try:
+            await record_messages([message_dict])
+        except Exception as e:
+            logger.error("Failed to update conversations: %s", e)
 
-    # Return MessageInDB with _id included in the dictionary
-    return MessageInDB(**message_dict)
+    return new_message
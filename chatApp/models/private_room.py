@@ -2,68 +2,105 @@ from collections.abc import Mapping
 from datetime import datetime
 from typing import Any
 
-from pydantic import BaseModel, Field
+from bson import ObjectId
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo.errors import DuplicateKeyError
 
+from chatApp.config.config import get_settings
 from chatApp.config.database import get_private_rooms_collection
+from chatApp.utils.cache import ReadThroughCache
 from chatApp.utils.object_id import PydanticObjectId
 
+from .conversation import add_conversations, add_room_summary
+from .membership import MembershipIndex, RoomMembership
+
+settings = get_settings()
+
+
+def make_pair_key(user1_id: str, user2_id: str) -> str:
+    """Return the key of a pair of users, the same in either order."""
+    return ":".join(sorted((str(user1_id), str(user2_id))))
+
 
 class PrivateRoom(BaseModel):
     member1: PydanticObjectId
     member2: PydanticObjectId
+    pair_key: str | None = Field(
+        default=None, description="Sorted member IDs, unique per pair"
+    )
+    members: list[PydanticObjectId] = Field(
+        default_factory=list, description="Sorted member IDs"
+    )
     created_at: datetime = Field(default_factory=lambda: datetime.now())
 
 
 class PrivateRoomInDB(PrivateRoom):
+    # Cached rooms are dumped by field name
+    model_config = ConfigDict(populate_by_name=True)
+
     id: PydanticObjectId = Field(alias="_id")
 
 
-async def fetch_private_room_by_id(id: str) -> PrivateRoomInDB | None:
+async def _load_membership(room_id: ObjectId) -> RoomMembership | None:
+    room_collection = get_private_rooms_collection()
+    room = await room_collection.find_one(
+        {"_id": room_id}, {"member1": 1, "member2": 1}
+    )
+    if room is None:
+        return None
+    return RoomMembership(members=(room["member1"], room["member2"]))
+
+
+# Private room members never change, so entries need no invalidation
+membership_index = MembershipIndex(_load_membership)
+
+
+async def _load_private_room(id: str) -> PrivateRoomInDB | None:
     room_collection = get_private_rooms_collection()
     room = await room_collection.find_one({"_id": PydanticObjectId(id)})
     return PrivateRoomInDB(**room) if room else None
 
 
+# Private rooms are never updated, entries only expire
+rooms_cache = ReadThroughCache(
+    "private_rooms",
+    _load_private_room,
+    ttl=settings.room_cache_ttl,
+    maxsize=settings.room_cache_max_entries,
+    model=PrivateRoomInDB,
+)
+
+
+async def fetch_private_room_by_id(id: str) -> PrivateRoomInDB | None:
+    """Fetch a private room by ID, cached for ``room_cache_ttl``."""
+    return await rooms_cache.get(id)
+
+
 async def fetch_private_room_by_members(
     user1_id: str, user2_id: str
 ) -> PrivateRoomInDB | None:
     rooms_collection = get_private_rooms_collection()
     room: Mapping[str, Any] | None = await rooms_collection.find_one(
-        {
-            "$or": [
-                {
-                    "member1": PydanticObjectId(user1_id),
-                    "member2": PydanticObjectId(user2_id),
-                },
-                {
-                    "member1": PydanticObjectId(user2_id),
-                    "member2": PydanticObjectId(user1_id),
-                },
-            ],
-        }
+        {"pair_key": make_pair_key(user1_id, user2_id)}
     )
     return PrivateRoomInDB(**room) if room else None
 
 
 async def check_user_in_private_room(room_id: str, user_id: str) -> bool:
-    room: PrivateRoomInDB | None = await fetch_private_room_by_id(room_id)
-    user_id_obj = PydanticObjectId(user_id)
-    return user_id_obj in [room.member1, room.member2] if room else False
+    membership = await membership_index.get(PydanticObjectId(room_id))
+    if membership is None:
+        return False
+    return membership.is_member(PydanticObjectId(user_id))
 
 
 async def get_user_private_rooms(user_id: str) -> list[PrivateRoomInDB]:
     rooms_collection = get_private_rooms_collection()
 
-    # Create a query to find private rooms for the specified user
-    query = {
-        "$or": [
-            {"member1": PydanticObjectId(user_id)},
-            {"member2": PydanticObjectId(user_id)},
-        ]
-    }
+    # One multikey index lookup, whatever the user's member position
+    query = {"members": PydanticObjectId(user_id)}
 
     # Fetch the documents using the query
-    cursor = rooms_collection.find(query)
+    cursor = rooms_collection.find(query).sort("_id", 1)
 
     # Convert the cursor to a list and await the result
     rooms = await cursor.to_list(length=None)
@@ -88,10 +125,23 @@ async def create_private_room(user1_id: str, user2_id: str) -> PrivateRoomInDB:
         new_room = PrivateRoom(
             member1=user1_id_obj,
             member2=user2_id_obj,
+            pair_key=make_pair_key(user1_id, user2_id),
+            members=sorted((user1_id_obj, user2_id_obj)),
             created_at=datetime.now(),
         )
-        new_room_obj = await rooms_collection.insert_one(
-            new_room.model_dump(by_alias=True)
+        try:
+            new_room_obj = await rooms_collection.insert_one(
+                new_room.model_dump(by_alias=True)
+            )
+        except DuplicateKeyError:
+            # Created concurrently by the other user
+            room = await fetch_private_room_by_members(user1_id, user2_id)
+            if room is None:
+                raise
+            return room
+        await add_room_summary(new_room_obj.inserted_id, new_room.created_at)
+        await add_conversations(
+            new_room_obj.inserted_id, "private", new_room.members
         )
         return PrivateRoomInDB(
             **new_room.model_dump(by_alias=True), _id=new_room_obj.inserted_id
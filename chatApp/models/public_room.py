@@ -2,12 +2,27 @@ from datetime import datetime
 from typing import Any
 
 from fastapi import status
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo import ASCENDING
 
+from chatApp.config.config import get_settings
 from chatApp.config.database import get_public_rooms_collection
 from chatApp.schemas.public_room import GetPublicRoomSchema
+from chatApp.utils.cache import ReadThroughCache, TTLCache
 from chatApp.utils.object_id import PydanticObjectId
 
+from .conversation import add_conversations, add_room_summary
+from .membership import MemberRoleIndex
+from .room_member import (
+    MEMBER_ROLES,
+    add_room_member,
+    fetch_member_role,
+    fetch_user_room_ids,
+    remove_room_member,
+)
+
+settings = get_settings()
+
 
 class PublicRoom(BaseModel):
     owner: PydanticObjectId
@@ -25,14 +40,8 @@ class PublicRoom(BaseModel):
     allow_file_sharing: bool = Field(
         default=True, description="Allow file sharing in the room"
     )
-    members: list[PydanticObjectId] = Field(
-        default_factory=list, description="List of user IDs"
-    )
-    ban_list: list[PydanticObjectId] = Field(
-        default_factory=list, description="List of IDs to be banned"
-    )
-    moderators: list[PydanticObjectId] = Field(
-        default_factory=list, description="List of moderator IDs"
+    members_count: int = Field(
+        default=0, description="Number of members, maintained with joins"
     )
     allow_users_access_message_history: bool = Field(
         True, description="Allow user to access message history"
@@ -44,77 +53,182 @@ class PublicRoom(BaseModel):
 
 
 class PublicRoomInDB(PublicRoom):
+    # Cached rooms are dumped by field name
+    model_config = ConfigDict(populate_by_name=True)
+
     id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
 
 
-async def fetch_all_public_rooms() -> list[GetPublicRoomSchema]:
-    """Fetch all public rooms and return them as a list of GetPublicRoomSchema."""
+# Memberships live in room_members, only the looked up users are cached
+membership_index = MemberRoleIndex(fetch_member_role)
+
+
+# The total is shown next to every page, a slightly stale value is fine
+_rooms_count_cache = TTLCache(maxsize=1, ttl=settings.public_rooms_count_ttl)
+
+
+async def count_public_rooms() -> int:
+    """Count the public rooms, cached for ``public_rooms_count_ttl``."""
+    count: int | None = _rooms_count_cache.get("count")
+    if count is None:
+        rooms_collection = get_public_rooms_collection()
+        count = await rooms_collection.count_documents({})
+        _rooms_count_cache.set("count", count)
+    return count
+
+
+async def fetch_public_rooms(
+    skip: int = 0, limit: int = 10, after: str | None = None
+) -> list[GetPublicRoomSchema]:
+    """
+    Fetch a page of public rooms ordered by ID.
+
+    Pagination is done by the database and member counts come from the
+    ``members_count`` counter, only the listed fields of the page's rooms
+    are transferred.
+
+    :param skip: Number of rooms to skip.
+    :param limit: Maximum number of rooms to return.
+    :param after: Only return rooms with a greater ID, for keyset paging.
+    """
     rooms_collection = get_public_rooms_collection()
-    rooms = await rooms_collection.find().to_list(length=None)
-    return [
-        GetPublicRoomSchema(**room, members_count=len(room["members"]))
-        for room in rooms
+    pipeline: list[dict[str, Any]] = []
+    if after is not None:
+        pipeline.append({"$match": {"_id": {"$gt": PydanticObjectId(after)}}})
+    pipeline += [
+        {"$sort": {"_id": ASCENDING}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {
+            "$project": {
+                "owner": 1,
+                "name": 1,
+                "description": 1,
+                "created_at": 1,
+                "members_count": 1,
+            }
+        },
     ]
+    rooms = await rooms_collection.aggregate(pipeline).to_list(length=limit)
+    return [GetPublicRoomSchema(**room) for room in rooms]
 
 
-async def fetch_public_room_by_id(id: str) -> PublicRoomInDB | None:
+async def _load_public_room(id: str) -> PublicRoomInDB | None:
     room_collection = get_public_rooms_collection()
     room = await room_collection.find_one({"_id": PydanticObjectId(id)})
     return PublicRoomInDB(**room) if room else None
 
 
-async def join_public_room(
-    room_id: str, user_id: str
-) -> tuple[bool, str | None, int]:
+# Rooms are read by most room requests, members_count may lag by the ttl
+rooms_cache = ReadThroughCache(
+    "public_rooms",
+    _load_public_room,
+    ttl=settings.room_cache_ttl,
+    maxsize=settings.room_cache_max_entries,
+    model=PublicRoomInDB,
+)
+
+
+async def fetch_public_room_by_id(id: str) -> PublicRoomInDB | None:
+    """Fetch a public room by ID, cached for ``room_cache_ttl``."""
+    return await rooms_cache.get(id)
+
+
+async def fetch_user_public_rooms(
+    user_id: str, after: str | None = None, limit: int = 50
+) -> tuple[list[GetPublicRoomSchema], str | None]:
+    """
+    Fetch a page of the public rooms a user is a member of, ordered by ID.
+
+    :param user_id: The user ID.
+    :param after: Only return rooms with a greater ID, for keyset paging.
+    :param limit: Maximum number of rooms to return.
+    :return: The rooms and the ID to pass as ``after`` for the next page.
+    """
+    room_ids = await fetch_user_room_ids(user_id, after=after, limit=limit)
+    next_after = str(room_ids[-1]) if len(room_ids) == limit else None
+
     rooms_collection = get_public_rooms_collection()
-    room: PublicRoomInDB | None = await fetch_public_room_by_id(room_id)
+    cursor = rooms_collection.find(
+        {"_id": {"$in": room_ids}},
+        {
+            "owner": 1,
+            "name": 1,
+            "description": 1,
+            "created_at": 1,
+            "members_count": 1,
+        },
+    ).sort("_id", ASCENDING)
+    rooms = await cursor.to_list(length=limit)
+    return [GetPublicRoomSchema(**room) for room in rooms], next_after
 
-    # Ensure room is not None
-    if room is None:
-        return False, "room not found", status.HTTP_404_NOT_FOUND
 
-    ban_list: list[PydanticObjectId] = room.ban_list
-    members: list[PydanticObjectId] = room.members
-    userObjId = PydanticObjectId(user_id)
+async def join_public_room(
+    room_id: str, user_id: str
+) -> tuple[bool, str | None, int]:
+    """
+    Add a user to a public room.
 
-    if userObjId not in ban_list:
-        if userObjId not in members:
-            members.append(userObjId)
+    The membership is inserted first, its unique index makes concurrent
+    joins of the same user create a single entry. A slot is then reserved
+    with a conditional increment of the room's ``members_count`` counter,
+    so concurrent joins cannot overfill the room, and the entry is removed
+    again when the room is full. A failure in between leaves the counter
+    short rather than leaking a slot, ``recount_public_room_members``
+    repairs it.
+    """
+    rooms_collection = get_public_rooms_collection()
+    room_id_obj = PydanticObjectId(room_id)
+    user_id_obj = PydanticObjectId(user_id)
 
-            # Update the room in the database
+    role = await fetch_member_role(room_id_obj, user_id_obj)
+    if role is None:
+        if await add_room_member(room_id_obj, user_id_obj):
             result = await rooms_collection.update_one(
-                {"_id": PydanticObjectId(room_id)},
-                {"$set": {"members": members}},  # Update only members
+                {
+                    "_id": room_id_obj,
+                    "$or": [
+                        {"max_members": None},
+                        {"$expr": {"$lt": ["$members_count", "$max_members"]}},
+                    ],
+                },
+                {"$inc": {"members_count": 1}},
             )
+            if result.modified_count == 0:
+                await remove_room_member(room_id_obj, user_id_obj)
+                if await rooms_collection.find_one(
+                    {"_id": room_id_obj}, {"_id": 1}
+                ):
+                    return False, "room is full", status.HTTP_409_CONFLICT
+                return False, "room not found", status.HTTP_404_NOT_FOUND
 
-            if result.modified_count == 1:
-                return True, None, status.HTTP_204_NO_CONTENT
-            else:
-                return (
-                    False,
-                    "something went wrong, please try again",
-                    status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )  # Failed to update the room in the database
+            await rooms_cache.invalidate(room_id)
+            membership_index.set(room_id_obj, user_id_obj, "member")
+            await add_conversations(room_id_obj, "public", [user_id_obj])
+            return True, None, status.HTTP_204_NO_CONTENT
+
+        # Another write created the entry first
+        role = await fetch_member_role(room_id_obj, user_id_obj)
+
+    membership_index.set(room_id_obj, user_id_obj, role)
+    if role == "banned":
         return (
-            True,
-            None,
-            status.HTTP_204_NO_CONTENT,
-        )  # User is already a member
+            False,
+            "you are banned from this room",
+            status.HTTP_403_FORBIDDEN,
+        )  # User is banned
     return (
-        False,
-        "you are banned from this room",
-        status.HTTP_403_FORBIDDEN,
-    )  # User is banned
+        True,
+        None,
+        status.HTTP_204_NO_CONTENT,
+    )  # User is already a member
 
 
 async def check_user_in_public_room(room_id: str, user_id: str) -> bool:
-    room: PublicRoomInDB | None = await fetch_public_room_by_id(room_id)
-    user_id_obj = PydanticObjectId(user_id)
-    if room is None:
-        return False
-    if user_id_obj not in room.ban_list or user_id_obj not in room.members:
-        return False
-    return True
+    role = await membership_index.get(
+        PydanticObjectId(room_id), PydanticObjectId(user_id)
+    )
+    return role in MEMBER_ROLES
 
 
 async def create_public_room(
@@ -127,12 +241,17 @@ async def create_public_room(
         **room_info,
         owner=user_id_obj,
         created_at=datetime.now(),
-        members=[user_id_obj],
+        members_count=1,
     )
 
     room_obj = await rooms_collection.insert_one(
         room.model_dump(by_alias=True)
     )
+    await add_room_member(room_obj.inserted_id, user_id_obj)
+    membership_index.set(room_obj.inserted_id, user_id_obj, "member")
+    await add_room_summary(room_obj.inserted_id, room.created_at)
+    await add_conversations(room_obj.inserted_id, "public", [user_id_obj])
+    _rooms_count_cache.clear()
     return PublicRoomInDB(
         **room.model_dump(by_alias=True), _id=room_obj.inserted_id
     )
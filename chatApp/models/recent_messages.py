@@ -0,0 +1,341 @@
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from bson import ObjectId
+
+from chatApp.config.config import get_settings
+from chatApp.services.metrics import registry
+from chatApp.utils.pagination import encode_cursor
+
+if TYPE_CHECKING:
+    from .message import MessageInDB
+
+settings = get_settings()
+
+# Rough per message overhead of the model and its fields, in bytes
+_MESSAGE_OVERHEAD = 512
+
+Position = tuple[datetime, ObjectId | None]
+
+
+def _single_process() -> bool:
+    """Whether every message of a room is written through this process."""
+    url = settings.socketio_message_queue
+    return not url or url.split("://", 1)[0] == "memory"
+
+
+def _newer_than(message: "MessageInDB", position: Position) -> bool:
+    created_at, id = position
+    if message.created_at != created_at or id is None:
+        return message.created_at > created_at
+    return message.id > id
+
+
+def _older_than(message: "MessageInDB", position: Position) -> bool:
+    created_at, id = position
+    if message.created_at != created_at or id is None:
+        return message.created_at < created_at
+    return message.id < id
+
+
+def _message_size(message: "MessageInDB") -> int:
+    return (
+        _MESSAGE_OVERHEAD
+        + len(message.content or "")
+        + len(message.media or "")
+    )
+
+
+class RoomBuffer:
+    """The most recent messages of one room, oldest first."""
+
+    __slots__ = ("messages", "complete", "loaded_at", "size")
+
+    def __init__(self, capacity: int) -> None:
+        self.messages: deque["MessageInDB"] = deque(maxlen=capacity)
+        # True when nothing older than the buffer exists in the room
+        self.complete = False
+        self.loaded_at = time.monotonic()
+        self.size = 0
+
+    def append(self, message: "MessageInDB") -> int:
+        """Add a message and return the change in the buffer size."""
+        removed = 0
+        if len(self.messages) == self.messages.maxlen:
+            removed = _message_size(self.messages[0])
+            self.complete = False
+        self.messages.append(message)
+        added = _message_size(message)
+        self.size += added - removed
+        return added - removed
+
+
+class RecentMessagesCache:
+    """
+    Per room ring buffers of the latest messages.
+
+    Buffers are seeded by history reads of the latest page, kept up to date
+    by the message write path and serve the history reads that fall
+    entirely inside them. The number of rooms and the total size are bounded,
+    the least recently used rooms are evicted first. Buffers expire after
+    ``ttl`` seconds.
+
+    A read only seeds a buffer when no message of the room was waiting to
+    be stored when it started and none was written while it ran, otherwise
+    the buffer could miss them. Buffers only see the messages written by
+    this process, so the cache is disabled when workers share a socket.io
+    message queue.
+    """
+
+    def __init__(
+        self,
+        capacity: int = settings.recent_messages_per_room,
+        max_rooms: int = settings.recent_messages_max_rooms,
+        max_bytes: int = settings.recent_messages_max_bytes,
+        ttl: float = settings.recent_messages_ttl,
+        enabled: bool | None = None,
+    ) -> None:
+        self.enabled = (
+            enabled
+            if enabled is not None
+            else settings.recent_messages_cache and _single_process()
+        )
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rooms: OrderedDict[ObjectId, RoomBuffer] = OrderedDict()
+        # Ids of the messages added but not stored yet, by room
+        self._unwritten: dict[ObjectId, set[ObjectId]] = {}
+        # Rooms with seeding reads in flight: the write generation and the
+        # number of reads
+        self._reads: dict[ObjectId, list[int]] = {}
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rooms": len(self._rooms),
+            "bytes": self.size,
+        }
+
+    def _get(self, room_id: ObjectId) -> RoomBuffer | None:
+        buffer = self._rooms.get(room_id)
+        if buffer is None:
+            return None
+        if time.monotonic() - buffer.loaded_at > self.ttl:
+            self.invalidate(room_id)
+            return None
+        self._rooms.move_to_end(room_id)
+        return buffer
+
+    def _evict(self) -> None:
+        while self._rooms and (
+            len(self._rooms) > self.max_rooms or self.size > self.max_bytes
+        ):
+            _, buffer = self._rooms.popitem(last=False)
+            self.size -= buffer.size
+            self.evictions += 1
+
+    def invalidate(self, room_id: ObjectId) -> None:
+        buffer = self._rooms.pop(room_id, None)
+        if buffer is not None:
+            self.size -= buffer.size
+
+    def begin_read(self, room_id: ObjectId) -> int | None:
+        """
+        Start a read of a room's latest messages that may seed its buffer.
+
+        :return: The generation to pass to :meth:`seed`, or None when
+            messages of the room are still waiting to be stored and the
+            read must not seed the buffer.
+        """
+        if room_id in self._unwritten:
+            return None
+        reads = self._reads.setdefault(room_id, [0, 0])
+        reads[1] += 1
+        return reads[0]
+
+    def end_read(self, room_id: ObjectId) -> None:
+        """Finish a read started by :meth:`begin_read`."""
+        reads = self._reads[room_id]
+        reads[1] -= 1
+        if not reads[1]:
+            del self._reads[room_id]
+
+    def seed(
+        self,
+        room_id: ObjectId,
+        messages: list["MessageInDB"],
+        complete: bool,
+        generation: int,
+    ) -> None:
+        """
+        Fill a room buffer from a read of the room's latest messages.
+
+        Must be called before the read's :meth:`end_read`. The buffer is
+        dropped instead when a message was added to the room since the read
+        began.
+
+        :param room_id: The room ID.
+        :param messages: The latest messages of the room, newest first.
+        :param complete: Whether these are all the messages of the room.
+        :param generation: The generation returned by :meth:`begin_read`.
+        """
+        self.invalidate(room_id)
+        if self._reads[room_id][0] != generation:
+            return
+        buffer = RoomBuffer(self.capacity)
+        for message in reversed(messages[: self.capacity]):
+            buffer.append(message)
+        buffer.complete = complete and len(messages) <= self.capacity
+        self._rooms[room_id] = buffer
+        self.size += buffer.size
+        self._evict()
+
+    def append(self, message: "MessageInDB") -> None:
+        """
+        Add a new message to its room buffer, if there is one.
+
+        Call before the message is stored and :meth:`written` once it is.
+        """
+        self._unwritten.setdefault(message.room_id, set()).add(message.id)
+        if message.room_id in self._reads:
+            self._reads[message.room_id][0] += 1
+        buffer = self._get(message.room_id)
+        if buffer is None:
+            # An unseeded buffer would miss the older messages
+            return
+        self.size += buffer.append(message)
+        self._evict()
+
+    def written(self, room_id: ObjectId, message_id: ObjectId) -> None:
+        """Record that an added message was stored, or failed to be."""
+        unwritten = self._unwritten.get(room_id)
+        if unwritten is None:
+            return
+        unwritten.discard(message_id)
+        if not unwritten:
+            del self._unwritten[room_id]
+
+    def boundary(
+        self, room_id: ObjectId, max_messages: int
+    ) -> tuple[bool, tuple[datetime, ObjectId] | None]:
+        """
+        Find the oldest of the latest ``max_messages`` messages of a room.
+
+        :return: Whether the buffer could answer, and the position of that
+            message or None if the room has fewer messages.
+        """
+        buffer = self._get(room_id)
+        if buffer is None:
+            return False, None
+        if len(buffer.messages) >= max_messages:
+            message = buffer.messages[-max_messages]
+            return True, (message.created_at, message.id)
+        return buffer.complete, None
+
+    def get_page(
+        self,
+        room_id: ObjectId,
+        limit: int,
+        before: Position | None = None,
+        after: Position | None = None,
+        lower_bound: Position | None = None,
+    ) -> tuple[list["MessageInDB"], str | None] | None:
+        """
+        Serve a history page from a room buffer.
+
+        Takes the same keyset arguments as the history query and returns the
+        same page, or None when the buffer cannot prove it holds every
+        message of the page.
+        """
+        buffer = self._get(room_id)
+        page = (
+            self._read(buffer, limit, before, after, lower_bound)
+            if buffer is not None
+            else None
+        )
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    @staticmethod
+    def _read(
+        buffer: RoomBuffer,
+        limit: int,
+        before: Position | None,
+        after: Position | None,
+        lower_bound: Position | None,
+    ) -> tuple[list["MessageInDB"], str | None] | None:
+        if not buffer.messages:
+            return ([], None) if buffer.complete else None
+
+        oldest = buffer.messages[0]
+        # Everything newer than the oldest buffered message is buffered, so
+        # a read is complete if it never needs to go past that message.
+        bounded = lower_bound is not None and not _newer_than(
+            oldest, lower_bound
+        )
+
+        if after is not None:
+            if not buffer.complete and _newer_than(oldest, after):
+                return None
+            newer = [
+                message
+                for message in buffer.messages
+                if _newer_than(message, after)
+                and (
+                    lower_bound is None
+                    or not _older_than(message, lower_bound)
+                )
+            ][:limit]
+            page = list(reversed(newer))
+            last = newer[-1] if len(newer) == limit else None
+        else:
+            older = [
+                message
+                for message in buffer.messages
+                if (before is None or _older_than(message, before))
+                and (
+                    lower_bound is None
+                    or not _older_than(message, lower_bound)
+                )
+            ]
+            if len(older) < limit and not (buffer.complete or bounded):
+                return None
+            page = list(reversed(older[-limit:]))
+            last = page[-1] if len(page) == limit else None
+
+        next_cursor = (
+            encode_cursor(last.created_at, last.id)
+            if last is not None
+            else None
+        )
+        return page, next_cursor
+
+
+recent_messages = RecentMessagesCache()
+
+recent_messages_stats = registry.gauge(
+    "recent_messages_cache",
+    "Recent messages cache hits, misses, evictions, rooms and bytes",
+    ["stat"],
+)
+
+
+async def collect_cache_metrics() -> None:
+    for stat, value in recent_messages.stats().items():
+        recent_messages_stats.set(value, stat)
+
+
+registry.add_collector(collect_cache_metrics)
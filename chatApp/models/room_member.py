@@ -0,0 +1,125 @@
+from datetime import datetime
+from typing import Literal
+
+from bson import ObjectId
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING
+
+from chatApp.config.database import get_room_members_collection
+from chatApp.utils.object_id import PydanticObjectId
+
+Role = Literal["member", "moderator", "banned"]
+
+# Roles that may read and write a room, banned users keep their entry
+MEMBER_ROLES: tuple[Role, ...] = ("member", "moderator")
+
+
+class RoomMember(BaseModel):
+    room_id: PydanticObjectId
+    user_id: PydanticObjectId
+    role: Role = Field(default="member", description="Role in the room")
+    joined_at: datetime = Field(default_factory=lambda: datetime.now())
+
+
+class RoomMemberInDB(RoomMember):
+    id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
+
+
+async def fetch_member_role(
+    room_id: ObjectId, user_id: ObjectId
+) -> Role | None:
+    """
+    Return a user's role in a room, or None if the user has no entry.
+
+    A point lookup on the unique (room_id, user_id) index.
+    """
+    members_collection = get_room_members_collection()
+    member = await members_collection.find_one(
+        {"room_id": room_id, "user_id": user_id}, {"role": 1, "_id": 0}
+    )
+    return member["role"] if member else None
+
+
+async def add_room_member(
+    room_id: ObjectId, user_id: ObjectId, role: Role = "member"
+) -> bool:
+    """
+    Add a user to a room unless they already have an entry.
+
+    :return: Whether the entry was created.
+    """
+    members_collection = get_room_members_collection()
+    member = RoomMember(room_id=room_id, user_id=user_id, role=role)
+    result = await members_collection.update_one(
+        {"room_id": room_id, "user_id": user_id},
+        {"$setOnInsert": member.model_dump(exclude={"room_id", "user_id"})},
+        upsert=True,
+    )
+    return result.upserted_id is not None
+
+
+async def remove_room_member(room_id: ObjectId, user_id: ObjectId) -> bool:
+    """
+    Remove a user's entry from a room.
+
+    :return: Whether an entry was removed.
+    """
+    members_collection = get_room_members_collection()
+    result = await members_collection.delete_one(
+        {"room_id": room_id, "user_id": user_id}
+    )
+    return result.deleted_count == 1
+
+
+async def fetch_room_members(
+    room_id: str, after: str | None = None, limit: int = 50
+) -> list[RoomMemberInDB]:
+    """
+    Fetch a page of the members of a room ordered by user ID.
+
+    :param room_id: The room ID.
+    :param after: Only return users with a greater ID, for keyset paging.
+    :param limit: Maximum number of members to return.
+    """
+    members_collection = get_room_members_collection()
+    query: dict = {
+        "room_id": PydanticObjectId(room_id),
+        "role": {"$in": MEMBER_ROLES},
+    }
+    if after is not None:
+        query["user_id"] = {"$gt": PydanticObjectId(after)}
+
+    cursor = (
+        members_collection.find(query).sort("user_id", ASCENDING).limit(limit)
+    )
+    members = await cursor.to_list(length=limit)
+    return [RoomMemberInDB(**member) for member in members]
+
+
+async def fetch_user_room_ids(
+    user_id: str, after: str | None = None, limit: int = 50
+) -> list[ObjectId]:
+    """
+    Fetch a page of the IDs of the rooms a user is a member of.
+
+    Served by the (user_id, room_id) index.
+
+    :param user_id: The user ID.
+    :param after: Only return rooms with a greater ID, for keyset paging.
+    :param limit: Maximum number of room IDs to return.
+    """
+    members_collection = get_room_members_collection()
+    query: dict = {
+        "user_id": PydanticObjectId(user_id),
+        "role": {"$in": MEMBER_ROLES},
+    }
+    if after is not None:
+        query["room_id"] = {"$gt": PydanticObjectId(after)}
+
+    cursor = (
+        members_collection.find(query, {"room_id": 1, "_id": 0})
+        .sort("room_id", ASCENDING)
+        .limit(limit)
+    )
+    members = await cursor.to_list(length=limit)
+    return [member["room_id"] for member in members]
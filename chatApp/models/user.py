@@ -1,14 +1,22 @@
-from collections.abc import Mapping
+import re
+from collections.abc import Iterable, Mapping, Sequence
 from datetime import datetime
 from typing import Any
 
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorCursor
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo import ASCENDING
 
+from chatApp.config.config import get_settings
 from chatApp.config.database import get_users_collection
+from chatApp.schemas.user import UserSummarySchema
 from chatApp.utils import hasher
+from chatApp.utils.cache import ReadThroughCache
 from chatApp.utils.object_id import PydanticObjectId
 
+settings = get_settings()
+
 
 class User(BaseModel):
     username: str
@@ -25,32 +33,182 @@ class UserInDB(User):
     id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
 
 
-async def get_all_users() -> list[Mapping[str, Any]]:
-    users_collection = get_users_collection()
+class UserProfile(BaseModel):
+    """A user read by ID, without credentials."""
+
+    # Cached users are dumped by field name
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(alias="_id")
+    username: str
+    email: str
+    is_active: bool = True
+    is_admin: bool = False
+
 
-    # Query to get users with necessary fields projected
-    cursor: AsyncIOMotorCursor = users_collection.find(
-        {}, {"_id": 1, "username": 1, "created_at": 1}
+class AuthenticatedUser(BaseModel):
+    """The user of an authenticated request, without credentials."""
+
+    id: PydanticObjectId
+    username: str
+    email: str
+    is_admin: bool = False
+
+    @classmethod
+    def from_user(cls, user: UserInDB | UserProfile) -> "AuthenticatedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_admin=user.is_admin,
+        )
+
+
+class UserLoader:
+    """
+    Request scoped batch loader of user summaries.
+
+    Resolves the users referenced by a page of messages or rooms with one
+    ``$in`` query instead of one query per item. Create one per request,
+    its results are not invalidated.
+    """
+
+    def __init__(self) -> None:
+        self._users: dict[ObjectId, UserSummarySchema | None] = {}
+
+    async def load_many(
+        self, user_ids: Iterable[ObjectId]
+    ) -> dict[ObjectId, UserSummarySchema]:
+        """
+        Load users by ID, querying only the ones not loaded before.
+
+        :return: The found users by ID, unknown IDs are left out.
+        """
+        user_ids = set(user_ids)
+        missing = [id for id in user_ids if id not in self._users]
+        if missing:
+            users_collection = get_users_collection()
+            cursor = users_collection.find(
+                {"_id": {"$in": missing}}, {"_id": 1, "username": 1}
+            )
+            for user in await cursor.to_list(length=len(missing)):
+                self._users[user["_id"]] = UserSummarySchema(**user)
+            for id in missing:
+                self._users.setdefault(id, None)
+
+        return {
+            id: user
+            for id in user_ids
+            if (user := self._users.get(id)) is not None
+        }
+
+    async def expand(
+        self, items: Sequence[BaseModel], fields: Mapping[str, str]
+    ) -> list[dict[str, Any]]:
+        """
+        Serialize items with the users they reference embedded.
+
+        :param items: The models to serialize.
+        :param fields: Maps each user ID field to the key of its user.
+        :return: The serialized items, unknown users are embedded as None.
+        """
+        users = await self.load_many(
+            getattr(item, field) for item in items for field in fields
+        )
+        expanded = []
+        for item in items:
+            data = item.model_dump(by_alias=True, mode="json")
+            for field, key in fields.items():
+                user = users.get(getattr(item, field))
+                data[key] = (
+                    user.model_dump(by_alias=True, mode="json")
+                    if user
+                    else None
+                )
+            expanded.append(data)
+        return expanded
+
+
+async def _load_user(user_id: str) -> UserProfile | None:
+    users_collection = get_users_collection()
+    document = await users_collection.find_one(
+        {"_id": PydanticObjectId(user_id)},
+        {"username": 1, "email": 1, "is_active": 1, "is_admin": 1},
     )
+    return UserProfile(**document) if document else None
 
-    # Collect all users into a list of UserInDB objects
-    return await cursor.to_list(length=None)
 
+# Users are read by every authenticated request, cached by ID without
+# their password hash
+users_cache = ReadThroughCache(
+    "users",
+    _load_user,
+    ttl=settings.user_cache_ttl,
+    maxsize=settings.user_cache_max_entries,
+    model=UserProfile,
+)
 
-async def fetch_user_by_username(username: str) -> UserInDB | None:
-    """Fetch a user from the database by username."""
+
+async def invalidate_user(user_id: str) -> None:
+    """Drop a user from the cache, call after every write to the user."""
+    await users_cache.invalidate(user_id)
+
+
+async def fetch_users(
+    after: str | None = None, prefix: str | None = None, limit: int = 50
+) -> list[Mapping[str, Any]]:
+    """
+    Fetch a page of the user directory.
+
+    Without a prefix users are ordered by ID. With one, only usernames
+    starting with the lowercased prefix match, ordered by username, so the
+    anchored regex is a range scan of the unique username index.
+
+    :param after: The ID of the last user of the previous page, or its
+        username when searching by prefix.
+    :param prefix: Username prefix to search for.
+    :param limit: Maximum number of users to return.
+    """
     users_collection = get_users_collection()
-    user = await users_collection.find_one({"username": username})
-    return UserInDB(**user) if user else None
 
+    query: dict[str, Any] = {}
+    if prefix:
+        query["username"] = {"$regex": f"^{re.escape(prefix.lower())}"}
+        if after is not None:
+            query["username"]["$gt"] = after
+        sort_key = "username"
+    else:
+        if after is not None:
+            query["_id"] = {"$gt": PydanticObjectId(after)}
+        sort_key = "_id"
+
+    cursor: AsyncIOMotorCursor = (
+        users_collection.find(
+            query, {"_id": 1, "username": 1, "created_at": 1}
+        )
+        .sort(sort_key, ASCENDING)
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def fetch_user_by_username(username: str) -> UserInDB | None:
+    """
+    Fetch a user from the database by username, case-insensitively.
 
-async def fetch_user_by_id(user_id: str) -> UserInDB | None:
-    """Fetch a user from the database by user ID."""
+    Usernames are stored lowercased, so this is a point lookup on the
+    unique username index.
+    """
     users_collection = get_users_collection()
-    user = await users_collection.find_one({"_id": PydanticObjectId(user_id)})
+    user = await users_collection.find_one({"username": username.lower()})
     return UserInDB(**user) if user else None
 
 
+async def fetch_user_by_id(user_id: str) -> UserProfile | None:
+    """Fetch a user by user ID, cached for ``user_cache_ttl``."""
+    return await users_cache.get(user_id)
+
+
 async def fetch_user_by_email(email: str) -> UserInDB | None:
     """Fetch a user from the database by email."""
     users_collection = get_users_collection()
@@ -62,14 +220,32 @@ async def create_user(user_dict: dict[str, Any]) -> UserInDB:
     """Create a new user in the database."""
     users_collection = get_users_collection()
 
+    # Lowercased so lookups, uniqueness and prefix searches all use the
+    # username index
+    user_dict["username"] = user_dict["username"].lower()
     user_dict["created_at"] = datetime.now()
     user_dict["updated_at"] = datetime.now()
     user_dict["last_login"] = datetime.now()
-    user_dict["hashed_password"] = hasher.get_password_hash(
-        user_dict["password"]
+    user_dict["hashed_password"] = await hasher.get_password_hash(
+        user_dict.pop("password")
     )
 
     result = await users_collection.insert_one(user_dict)
     user_dict["_id"] = str(result.inserted_id)
 
     return UserInDB(**user_dict)
+
+
+async def update_user(user_id: str, changes: dict[str, Any]) -> bool:
+    """
+    Update the given fields of a user.
+
+    :return: Whether the user exists.
+    """
+    users_collection = get_users_collection()
+    result = await users_collection.update_one(
+        {"_id": PydanticObjectId(user_id)},
+        {"$set": {**changes, "updated_at": datetime.now()}},
+    )
+    await invalidate_user(user_id)
+    return result.matched_count == 1
@@ -12,8 +12,10 @@ from chatApp.utils.exceptions import credentials_exception
 router = APIRouter()
 
 
-@router.post("/register", response_model=user_model.UserInDB)
-async def register_user(user_info: UserCreateSchema) -> user_model.UserInDB:
+@router.post("/register", response_model=user_model.AuthenticatedUser)
+async def register_user(
+    user_info: UserCreateSchema,
+) -> user_model.AuthenticatedUser:
     existing_user = await user_model.fetch_user_by_username(user_info.username)
     if existing_user:
         raise HTTPException(
@@ -30,7 +32,7 @@ async def register_user(user_info: UserCreateSchema) -> user_model.UserInDB:
     user_dict = user_info.model_dump()
     user = await user_model.create_user(user_dict)
 
-    return user
+    return user_model.AuthenticatedUser.from_user(user)
 
 
 @router.post("/token", response_model=dict)
@@ -43,11 +45,7 @@ async def login_for_access_token(
 
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     refresh_token_expires = timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS)
-    data_to_encode = {
-        "username": user.username,
-        "email": user.email,
-        "id": str(user.id),
-    }
+    data_to_encode = auth.token_claims(user)
 
     access_token = auth.create_token(
         data=data_to_encode,
@@ -71,14 +69,12 @@ async def login_for_access_token(
 @router.post("/token/refresh", response_model=dict)
 async def refresh_token(token: str) -> dict[str, str]:
     try:
-        payload: dict[str, Any] = auth.parse_token(token)
-        if not auth.validate_token(token):
-            raise credentials_exception
+        payload: dict[str, Any] = auth.verify_token(token, "refresh")
 
         user_id: str = payload["id"]
-        user: user_model.UserInDB | None = await user_model.fetch_user_by_id(
-            user_id
-        )
+        user: (
+            user_model.UserProfile | None
+        ) = await user_model.fetch_user_by_id(user_id)
         if user is None:
             raise credentials_exception
 
@@ -86,11 +82,7 @@ async def refresh_token(token: str) -> dict[str, str]:
             minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES
         )
         refresh_token_expires = timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS)
-        data_to_encode = {
-            "username": user.username,
-            "email": user.email,
-            "id": str(user.id),
-        }
+        data_to_encode = auth.token_claims(user)
 
         new_access_token = auth.create_token(
             data=data_to_encode,
@@ -114,8 +106,10 @@ async def refresh_token(token: str) -> dict[str, str]:
         raise credentials_exception
 
 
-@router.get("/users/me/", response_model=user_model.UserInDB)
+@router.get("/users/me/", response_model=user_model.AuthenticatedUser)
 async def read_users_me(
-    current_user: user_model.UserInDB = Depends(auth.get_current_user),
-) -> user_model.UserInDB:
+    current_user: user_model.AuthenticatedUser = Depends(
+        auth.get_current_user
+    ),
+) -> user_model.AuthenticatedUser:
     return current_user
@@ -1,20 +1,66 @@
-from collections.abc import Mapping
-from typing import Any
+from collections.abc import AsyncIterator, Mapping, Sequence
+from typing import Any, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Path
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi.responses import StreamingResponse
 
 from chatApp.config import auth
-from chatApp.models import message, private_room, public_room, user
+from chatApp.config.config import get_settings
+from chatApp.models import (
+    conversation,
+    message,
+    private_room,
+    public_room,
+    room_member,
+    user,
+)
 from chatApp.schemas.public_room import CreatePublicRoom, GetPublicRoomSchema
 from chatApp.utils.object_id import is_valid_object_id
 
 router = APIRouter()
+settings = get_settings()
+
+CURSOR_DESCRIPTION = "message id, next_cursor of a previous page or timestamp"
+EXPAND_DESCRIPTION = "user embeds the referenced users, resolved in one query"
+
+Expand = Literal["user"]
+
+
+async def stream_messages(chunks: AsyncIterator[bytes]) -> StreamingResponse:
+    """
+    Wrap an export in an NDJSON streaming response.
+
+    The first chunk is read before the response starts, so an invalid
+    cursor is still reported as a 400 instead of a broken stream.
+    """
+    try:
+        first = await anext(chunks, b"")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def body() -> AsyncIterator[bytes]:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def message_page(
+    messages: Sequence[message.MessageInDB | Mapping[str, Any]],
+    next_cursor: str | None,
+    limit: int,
+) -> dict[str, Any]:
+    return {
+        "data": messages,
+        "meta": {"next_cursor": next_cursor, "limit": limit},
+    }
 
 
 @router.post("/create-public-room", response_model=public_room.PublicRoomInDB)
 async def create_public_room(
     room_info: CreatePublicRoom,
-    user: user.UserInDB = Depends(auth.get_current_user),
+    user: user.AuthenticatedUser = Depends(auth.get_current_user),
 ):
     return await public_room.create_public_room(
         owner=str(user.id), room_info=room_info.model_dump(by_alias=True)
@@ -26,62 +72,149 @@ async def create_public_room(
 )
 async def join_public_room(
     room_id: str = Path(..., description="ID of the public room to join"),
-    user: user.UserInDB = Depends(auth.get_current_user),
+    user: user.AuthenticatedUser = Depends(auth.get_current_user),
 ):
     if not is_valid_object_id(room_id):
         raise HTTPException(status_code=400, detail="Invalid room ID format")
 
-    # Check if the room exists
-    room = await public_room.fetch_public_room_by_id(room_id)
-    if room is None:
-        raise HTTPException(status_code=404, detail="Room not found")
-
     result, report, code = await public_room.join_public_room(
         room_id, str(user.id)
     )
-    if result:
-        return room
-    else:
+    if not result:
         raise HTTPException(detail=report, status_code=code)
 
+    room = await public_room.fetch_public_room_by_id(room_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return room
+
 
 @router.get("/get-public-rooms", response_model=Mapping[str, Any])
 async def get_public_rooms(
-    page: int = 1,
-    per_page: int = 10,
+    page: int = Query(1, ge=1),
+    per_page: int = Query(10, ge=1, le=settings.public_rooms_max_page_size),
+    after: str | None = Query(
+        None, description="id of the last room of the previous page"
+    ),
+    expand: Expand | None = Query(None, description=EXPAND_DESCRIPTION),
+    loader: user.UserLoader = Depends(user.UserLoader),
 ):
-    all_rooms: list[
-        GetPublicRoomSchema
-    ] = await public_room.fetch_all_public_rooms()
-    total_count = len(all_rooms)
+    if after is not None and not is_valid_object_id(after):
+        raise HTTPException(status_code=400, detail="Invalid room id")
 
-    # Calculate pagination indexes
-    start_index = (page - 1) * per_page
-    end_index = start_index + per_page
+    total_count = await public_room.count_public_rooms()
 
+    # With a keyset position the page number is only informative
+    start_index = 0 if after is not None else (page - 1) * per_page
     if start_index >= total_count:
         raise HTTPException(status_code=404, detail="Page out of range")
 
-    paginated_rooms = all_rooms[start_index:end_index]
+    paginated_rooms: list[
+        GetPublicRoomSchema
+    ] = await public_room.fetch_public_rooms(
+        skip=start_index, limit=per_page, after=after
+    )
 
     data_to_return = {
-        "data": paginated_rooms,
+        "data": (
+            await loader.expand(paginated_rooms, {"owner": "owner_user"})
+            if expand
+            else paginated_rooms
+        ),
         "meta": {
             "total_count": total_count,
             "page": page,
             "per_page": per_page,
+            "next_after": (
+                str(paginated_rooms[-1].id)
+                if len(paginated_rooms) == per_page
+                else None
+            ),
         },
     }
     return data_to_return
 
 
+@router.get("/public-room/{room_id}/members", response_model=Mapping[str, Any])
+async def get_public_room_members(
+    room_id: str = Path(..., description="id of the public room"),
+    after: str | None = Query(
+        None, description="user id of the last member of the previous page"
+    ),
+    limit: int = Query(
+        settings.room_members_page_size,
+        ge=1,
+        le=settings.room_members_max_page_size,
+    ),
+    expand: Expand | None = Query(None, description=EXPAND_DESCRIPTION),
+    loader: user.UserLoader = Depends(user.UserLoader),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
+):
+    if not is_valid_object_id(room_id):
+        raise HTTPException(status_code=400, detail="Invalid room id")
+    if after is not None and not is_valid_object_id(after):
+        raise HTTPException(status_code=400, detail="Invalid user id")
+
+    if not await public_room.check_user_in_public_room(room_id, str(user.id)):
+        raise HTTPException(
+            status_code=403, detail="User not a member of the room"
+        )
+
+    members = await room_member.fetch_room_members(
+        room_id, after=after, limit=limit
+    )
+    return {
+        "data": (
+            await loader.expand(members, {"user_id": "user"})
+            if expand
+            else members
+        ),
+        "meta": {
+            "limit": limit,
+            "next_after": (
+                str(members[-1].user_id) if len(members) == limit else None
+            ),
+        },
+    }
+
+
+@router.get("/get-my-public-rooms", response_model=Mapping[str, Any])
+async def get_my_public_rooms(
+    after: str | None = Query(
+        None, description="id of the last room of the previous page"
+    ),
+    limit: int = Query(
+        settings.room_members_page_size,
+        ge=1,
+        le=settings.room_members_max_page_size,
+    ),
+    expand: Expand | None = Query(None, description=EXPAND_DESCRIPTION),
+    loader: user.UserLoader = Depends(user.UserLoader),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
+):
+    if after is not None and not is_valid_object_id(after):
+        raise HTTPException(status_code=400, detail="Invalid room id")
+
+    rooms, next_after = await public_room.fetch_user_public_rooms(
+        str(user.id), after=after, limit=limit
+    )
+    return {
+        "data": (
+            await loader.expand(rooms, {"owner": "owner_user"})
+            if expand
+            else rooms
+        ),
+        "meta": {"limit": limit, "next_after": next_after},
+    }
+
+
 @router.post(
     "/create-private-room/{person_id}",
     response_model=private_room.PrivateRoomInDB,
 )
 async def create_private_room(
     person_id: str = Path(..., description="other person's id"),
-    user: user.UserInDB = Depends(auth.get_current_user),
+    user: user.AuthenticatedUser = Depends(auth.get_current_user),
 ):
     if not is_valid_object_id(person_id):
         raise HTTPException(status_code=400, detail="Invalid person ID format")
@@ -94,7 +227,7 @@ async def create_private_room(
     "/get-private-rooms", response_model=list[private_room.PrivateRoomInDB]
 )
 async def get_private_rooms(
-    user: user.UserInDB = Depends(auth.get_current_user),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
 ):
     return await private_room.get_user_private_rooms(str(user.id))
 
@@ -104,7 +237,7 @@ async def get_private_rooms(
 )
 async def get_private_room(
     room_id: str = Path(..., description="ID of the private room to retrieve"),
-    user: user.UserInDB = Depends(auth.get_current_user),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
 ):
     if not is_valid_object_id(room_id):
         raise HTTPException(status_code=400, detail="Invalid room ID format")
@@ -123,12 +256,56 @@ async def get_private_room(
     return room
 
 
-@router.get(
-    "/get-messages/public/{room_id}", response_model=list[message.MessageInDB]
-)
+@router.get("/get-conversations", response_model=Mapping[str, Any])
+async def get_conversations(
+    before: str | None = Query(
+        None, description="next_cursor of the previous page"
+    ),
+    limit: int = Query(
+        settings.conversations_page_size,
+        ge=1,
+        le=settings.conversations_max_page_size,
+    ),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
+):
+    try:
+        conversations, next_cursor = await conversation.fetch_conversations(
+            str(user.id), before=before, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "data": conversations,
+        "meta": {"next_cursor": next_cursor, "limit": limit},
+    }
+
+
+@router.post("/mark-conversation-read/{room_id}", status_code=204)
+async def mark_conversation_read(
+    room_id: str = Path(..., description="id of the room"),
+    user: user.AuthenticatedUser = Depends(auth.get_current_user),
+) -> None:
+    if not is_valid_object_id(room_id):
+        raise HTTPException(status_code=400, detail="Invalid room id")
+
+    if not await conversation.mark_conversation_read(room_id, str(user.id)):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+
+@router.get("/get-messages/public/{room_id}", response_model=Mapping[str, Any])
 async def get_messages_of_public_room(
     room_id: str = Path(..., description="id of the public room"),
-    user: user.UserInDB = Depends(auth.get_current_user),
+    before: str | None = Query(None, description=CURSOR_DESCRIPTION),
+    after: str | None = Query(None, description=CURSOR_DESCRIPTION),
+    limit: int = Query(
+        settings.messages_page_size,
+        ge=1,
+        le=settings.messages_max_page_size,
+    ),
+    expand: Expand | None = Query(None, description=EXPAND_DESCRIPTION),
+    loader: user.UserLoader = Depends(user.UserLoader),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
 ):
     if not is_valid_object_id(room_id):
         raise HTTPException(status_code=400, detail="Invalid room id")
@@ -142,15 +319,37 @@ async def get_messages_of_public_room(
             status_code=403, detail="User not a member of the room"
         )
 
-    return await message.get_public_messages(room_id)
+    try:
+        messages, next_cursor = await message.get_public_messages(
+            room, before=before, after=after, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if expand:
+        return message_page(
+            await loader.expand(messages, {"user_id": "user"}),
+            next_cursor,
+            limit,
+        )
+    return message_page(messages, next_cursor, limit)
 
 
 @router.get(
-    "/get-messages/private/{room_id}", response_model=list[message.MessageInDB]
+    "/get-messages/private/{room_id}", response_model=Mapping[str, Any]
 )
 async def get_messages_of_private_room(
     room_id: str = Path(..., description="id of the private room"),
-    user: user.UserInDB = Depends(auth.get_current_user),
+    before: str | None = Query(None, description=CURSOR_DESCRIPTION),
+    after: str | None = Query(None, description=CURSOR_DESCRIPTION),
+    limit: int = Query(
+        settings.messages_page_size,
+        ge=1,
+        le=settings.messages_max_page_size,
+    ),
+    expand: Expand | None = Query(None, description=EXPAND_DESCRIPTION),
+    loader: user.UserLoader = Depends(user.UserLoader),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
 ):
     if not is_valid_object_id(room_id):
         raise HTTPException(status_code=400, detail="Invalid room id")
@@ -159,11 +358,78 @@ async def get_messages_of_private_room(
     if room is None:
         raise HTTPException(status_code=404, detail="Private room not found")
 
-    if not await public_room.check_user_in_public_room(
+    if not await private_room.check_user_in_private_room(
         str(room.id), str(user.id)
     ):
         raise HTTPException(
             status_code=403, detail="User not a member of the room"
         )
 
-    return await message.get_private_messages(room_id)
+    try:
+        messages, next_cursor = await message.get_private_messages(
+            room, before=before, after=after, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if expand:
+        return message_page(
+            await loader.expand(messages, {"user_id": "user"}),
+            next_cursor,
+            limit,
+        )
+    return message_page(messages, next_cursor, limit)
+
+
+@router.get("/export-messages/public/{room_id}")
+async def export_messages_of_public_room(
+    room_id: str = Path(..., description="id of the public room"),
+    after: str | None = Query(None, description=CURSOR_DESCRIPTION),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
+) -> StreamingResponse:
+    if not is_valid_object_id(room_id):
+        raise HTTPException(status_code=400, detail="Invalid room id")
+
+    room = await public_room.fetch_public_room_by_id(room_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail="Public room not found")
+
+    if not await public_room.check_user_in_public_room(room_id, str(user.id)):
+        raise HTTPException(
+            status_code=403, detail="User not a member of the room"
+        )
+
+    if not room.allow_users_access_message_history:
+        raise HTTPException(
+            status_code=403, detail="Message history is disabled"
+        )
+
+    return await stream_messages(
+        message.export_room_messages(
+            room_id,
+            "public",
+            after=after,
+            max_messages=room.max_latest_messages_access,
+        )
+    )
+
+
+@router.get("/export-messages/private/{room_id}")
+async def export_messages_of_private_room(
+    room_id: str = Path(..., description="id of the private room"),
+    after: str | None = Query(None, description=CURSOR_DESCRIPTION),
+    user: user.AuthenticatedUser = Depends(auth.get_token_user),
+) -> StreamingResponse:
+    if not is_valid_object_id(room_id):
+        raise HTTPException(status_code=400, detail="Invalid room id")
+
+    if not await private_room.check_user_in_private_room(
+        room_id, str(user.id)
+    ):
+        raise HTTPException(
+            status_code=403, detail="User not a member of the room"
+        )
+
+    return await stream_messages(
+        message.export_room_messages(room_id, "private", after=after)
+    )
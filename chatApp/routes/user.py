@@ -1,19 +1,46 @@
 from collections.abc import Mapping
 from typing import Any
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
 
+from chatApp.config.config import get_settings
 from chatApp.models import user as user_model
 from chatApp.schemas.user import UserListSchema
+from chatApp.utils.object_id import is_valid_object_id
 
 router = APIRouter()
+settings = get_settings()
 
 
 @router.get("/", response_model=Mapping[str, Any])
-async def get_all_users():
-    users: list[Mapping[str, Any]] = await user_model.get_all_users()
+async def get_all_users(
+    q: str | None = Query(
+        None, max_length=64, description="username prefix to search for"
+    ),
+    after: str | None = Query(
+        None,
+        description=(
+            "id of the last user of the previous page, "
+            "its username when searching"
+        ),
+    ),
+    limit: int = Query(
+        settings.users_page_size, ge=1, le=settings.users_max_page_size
+    ),
+):
+    if not q and after is not None and not is_valid_object_id(after):
+        raise HTTPException(status_code=400, detail="Invalid user id")
+
+    users: list[Mapping[str, Any]] = await user_model.fetch_users(
+        after=after, prefix=q, limit=limit
+    )
+
+    next_after = None
+    if len(users) == limit:
+        next_after = str(users[-1]["username" if q else "_id"])
 
     return {
         "users": [UserListSchema(**user) for user in users],
         "count": len(users),
+        "next_after": next_after,
     }
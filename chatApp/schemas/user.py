@@ -15,3 +15,8 @@ class UserListSchema(BaseModel):
     id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
     username: str
     created_at: datetime = datetime.now()
+
+
+class UserSummarySchema(BaseModel):
+    id: PydanticObjectId = Field(alias="_id", serialization_alias="id")
+    username: str
@@ -0,0 +1,195 @@
+import asyncio
+from typing import Any
+
+from pymongo.errors import BulkWriteError
+
+from chatApp.config.config import get_settings
+from chatApp.config.database import get_messages_collection
+from chatApp.config.logs import get_logger
+from chatApp.models.conversation import record_messages
+from chatApp.models.recent_messages import recent_messages
+from chatApp.services.metrics import registry
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+_Item = tuple[dict[str, Any], asyncio.Future | None]
+
+
+class MessageWriter:
+    """
+    Write-behind buffer for chat messages.
+
+    Messages are queued and written with ``insert_many`` once a batch is full
+    or the flush interval has elapsed, then the batch is applied to the room
+    summaries with one update per room and per sender. The queue is
+    bounded, so producers wait when the database falls behind instead of
+    growing memory without limit.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.message_write_batch_size,
+        flush_interval: float = settings.message_write_flush_interval,
+        max_pending: int = settings.message_write_max_pending,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue[_Item | None] = asyncio.Queue(
+            maxsize=max_pending
+        )
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(
+        self, document: dict[str, Any], durable: bool | None = None
+    ) -> None:
+        """
+        Queue a message document for insertion.
+
+        :param document: The message document, including its ``_id``.
+        :param durable: Wait until the document is written, defaults to the
+            ``message_write_durable_ack`` setting.
+        :raises RuntimeError: If the writer is not running.
+        :raises PyMongoError: If a durable write failed.
+        """
+        if self._task is None or self._closing:
+            raise RuntimeError("Message writer is not running.")
+
+        if durable is None:
+            durable = settings.message_write_durable_ack
+        future = (
+            asyncio.get_running_loop().create_future() if durable else None
+        )
+
+        # Blocks while the queue is full, pushing back on the senders
+        await self.queue.put((document, future))
+        if future is not None:
+            await future
+
+    async def close(self) -> None:
+        """Stop accepting messages and write everything still queued."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            batch: list[_Item] = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size and not stopping:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    # Give the batch one chance to fill up before the
+                    # deadline instead of waking up for every message.
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    await asyncio.sleep(timeout)
+                    continue
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[_Item]) -> None:
+        documents = [document for document, _ in batch]
+        failed: dict[int, Exception] = {}
+        try:
+            await get_messages_collection().insert_many(
+                documents, ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = e
+        except Exception as e:
+            failed = dict.fromkeys(range(len(batch)), e)
+
+        if failed:
+            logger.error(
+                "Failed to write %d of %d queued messages",
+                len(failed),
+                len(batch),
+            )
+
+        for index, document in enumerate(documents):
+            if index in failed:
+                # The room buffer holds a message that was never stored
+                recent_messages.invalidate(document["room_id"])
+            recent_messages.written(document["room_id"], document["_id"])
+
+        for index, (_, future) in enumerate(batch):
+            if future is None or future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(None)
+
+        # The room summaries are derived data, their update never fails
+        # the messages themselves
+        try:
+            await record_messages(
+                document
+                for index, document in enumerate(documents)
+                if index not in failed
+            )
+        except Exception as e:
+            logger.error("Failed to update conversations: %s", e)
+
+
+message_writer: MessageWriter | None = None
+
+
+async def init_message_writer() -> MessageWriter | None:
+    global message_writer
+    if settings.message_write_behind:
+        message_writer = MessageWriter()
+        message_writer.start()
+    return message_writer
+
+
+async def shutdown_message_writer() -> None:
+    global message_writer
+    if message_writer is not None:
+        await message_writer.close()
+        message_writer = None
+
+
+message_write_queue_depth = registry.gauge(
+    "message_write_queue_depth", "Messages queued for the next batch writes"
+)
+
+
+async def collect_writer_metrics() -> None:
+    message_write_queue_depth.set(
+        message_writer.queue.qsize() if message_writer is not None else 0
+    )
+
+
+registry.add_collector(collect_writer_metrics)
+
+
+def get_message_writer() -> MessageWriter | None:
+    """
+    Retrieve the running message writer.
+
+    :return: The writer, or None when write-behind is disabled.
+    """
+    return message_writer
@@ -0,0 +1,172 @@
+import asyncio
+import functools
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from pymongo import monitoring
+
+from chatApp.utils.metrics import MetricsRegistry
+
+# Metrics of this worker, exposed on /metrics
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+socketio_events = registry.counter(
+    "socketio_events_total",
+    "Socket.IO events handled by event name",
+    ["event"],
+)
+socketio_event_duration = registry.histogram(
+    "socketio_event_duration_seconds",
+    "Socket.IO handler latency by event name",
+    ["event"],
+)
+socketio_emit_recipients = registry.histogram(
+    "socketio_emit_recipients",
+    "Clients of this worker reached by a room emit",
+    ["event"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000),
+)
+singleflight_calls = registry.counter(
+    "singleflight_calls_total",
+    "Loads started (leader) and loads joining one in flight (shared)",
+    ["name", "role"],
+)
+mongo_pool_checkout_wait = registry.histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting for a MongoDB connection from the pool",
+)
+mongo_pool_checkout_failures = registry.counter(
+    "mongo_pool_checkout_failures_total",
+    "Failed MongoDB connection checkouts by reason",
+    ["reason"],
+)
+mongo_pool_connections_in_use = registry.gauge(
+    "mongo_pool_connections_in_use",
+    "MongoDB connections checked out of the pool",
+)
+
+
+def observe_emit(server: Any, event: str, room: str) -> None:
+    """Record how many clients of this worker a room emit reached."""
+    participants = server.manager.rooms.get("/", {}).get(room, ())
+    socketio_emit_recipients.observe(len(participants), event)
+
+
+def timed_event(
+    handler: Callable[..., Awaitable[Any]],
+) -> Callable[..., Awaitable[Any]]:
+    """Count and time a Socket.IO event handler, named after the handler."""
+    event = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start_time = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            socketio_events.inc(event)
+            socketio_event_duration.observe(
+                time.perf_counter() - start_time, event
+            )
+
+    return wrapper
+
+
+def record_threadsafe(
+    loop: asyncio.AbstractEventLoop | None,
+    record: Callable[..., None],
+    *args: Any,
+) -> None:
+    """
+    Run a metric update on the event loop, from a driver thread.
+
+    Metrics are only changed on the event loop, so listeners pymongo calls
+    from its threads hand their updates over. Updates before a loop is
+    bound or after it closed are dropped.
+    """
+    if loop is None:
+        return
+    try:
+        loop.call_soon_threadsafe(record, *args)
+    except RuntimeError:
+        pass  # The loop is closed
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Records connection pool checkouts.
+
+    pymongo calls listeners from its own threads, the updates are handed
+    over to the event loop the listener was bound on.
+    """
+
+    def __init__(self) -> None:
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def bind(self) -> None:
+        """Record the metrics on the running loop."""
+        self.loop = asyncio.get_running_loop()
+
+    def connection_check_out_started(
+        self, event: monitoring.ConnectionCheckOutStartedEvent
+    ) -> None:
+        pass
+
+    def connection_checked_out(
+        self, event: monitoring.ConnectionCheckedOutEvent
+    ) -> None:
+        if event.duration is not None:
+            record_threadsafe(
+                self.loop, mongo_pool_checkout_wait.observe, event.duration
+            )
+        record_threadsafe(self.loop, mongo_pool_connections_in_use.inc)
+
+    def connection_check_out_failed(
+        self, event: monitoring.ConnectionCheckOutFailedEvent
+    ) -> None:
+        if event.duration is not None:
+            record_threadsafe(
+                self.loop, mongo_pool_checkout_wait.observe, event.duration
+            )
+        record_threadsafe(
+            self.loop, mongo_pool_checkout_failures.inc, str(event.reason)
+        )
+
+    def connection_checked_in(
+        self, event: monitoring.ConnectionCheckedInEvent
+    ) -> None:
+        record_threadsafe(self.loop, mongo_pool_connections_in_use.dec)
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(
+        self, event: monitoring.ConnectionCreatedEvent
+    ) -> None:
+        pass
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(
+        self, event: monitoring.ConnectionClosedEvent
+    ) -> None:
+        pass
+
+
+pool_metrics = PoolMetricsListener()
@@ -0,0 +1,87 @@
+import asyncio
+
+import socketio
+
+from chatApp.config.cluster import ClusterState
+from chatApp.config.config import get_settings
+from chatApp.config.logs import get_logger
+from chatApp.services.metrics import observe_emit
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+# socket.io room of the clients subscribed to the total client count
+CLIENT_COUNT_ROOM = "counts"
+
+
+def room_count_room(room_id: str) -> str:
+    """Return the socket.io room of the clients subscribed to a room count."""
+    return f"counts:{room_id}"
+
+
+class PresenceBroadcaster:
+    """
+    Coalesces client and room count updates.
+
+    Connects, disconnects, joins and leaves only mark counts as dirty. Once
+    per tick, one update per dirty count is sent to the clients that
+    subscribed to it, so a reconnect storm costs one emit per room per tick
+    instead of one global emit per event.
+    """
+
+    def __init__(
+        self,
+        server: socketio.AsyncServer,
+        state: ClusterState,
+        tick: float = settings.presence_tick_seconds,
+    ) -> None:
+        self.server = server
+        self.state = state
+        self.tick = tick
+        self._clients_dirty = False
+        self._dirty_rooms: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    def mark_clients(self) -> None:
+        self._clients_dirty = True
+
+    def mark_room(self, room_id: str) -> None:
+        self._dirty_rooms.add(room_id)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to broadcast presence counts: %s", e)
+
+    async def flush(self) -> None:
+        """Send one update for every count that changed since the last tick."""
+        if self._clients_dirty:
+            self._clients_dirty = False
+            await self.server.emit(
+                "client_count",
+                data=await self.state.get_clients(),
+                room=CLIENT_COUNT_ROOM,
+            )
+            observe_emit(self.server, "client_count", CLIENT_COUNT_ROOM)
+
+        rooms, self._dirty_rooms = self._dirty_rooms, set()
+        for room_id in rooms:
+            await self.server.emit(
+                "room_count",
+                data=await self.state.get_room(room_id),
+                room=room_count_room(room_id),
+            )
+            observe_emit(self.server, "room_count", room_count_room(room_id))
@@ -0,0 +1,305 @@
+import asyncio
+import json
+from collections.abc import Iterator, Mapping
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from chatApp.config.config import get_settings
+from chatApp.config.logs import get_logger
+from chatApp.services.metrics import record_threadsafe, registry
+from chatApp.utils.cache import TTLCache
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+mongo_command_duration = registry.histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by collection and command",
+    ["collection", "command"],
+)
+mongo_slow_commands = registry.counter(
+    "mongo_slow_commands_total",
+    "MongoDB commands slower than the slow query threshold",
+    ["collection", "command"],
+)
+mongo_collection_scans = registry.counter(
+    "mongo_collection_scans_total",
+    "Explained slow query shapes whose winning plan scans the collection",
+    ["collection"],
+)
+
+# Commands that accept explain, with the fields describing their query
+EXPLAINABLE_FIELDS = {
+    "find": ("filter", "sort", "projection"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort"),
+}
+# Fields describing the query of the statements of write commands
+STATEMENT_FIELDS = {
+    "update": ("updates", ("q",)),
+    "delete": ("deletes", ("q",)),
+}
+# Command fields set by the driver or the session, refused by explain
+DRIVER_FIELDS = (
+    "lsid",
+    "txnNumber",
+    "$db",
+    "$clusterTime",
+    "$readPreference",
+    "readConcern",
+    "writeConcern",
+)
+
+
+def redact(value: Any) -> Any:
+    """
+    Replace the values of a query with ``"?"``, keeping its shape.
+
+    Field names and operators are kept, lists keep one entry per distinct
+    shape, so ``$in`` lists of any length redact to the same shape.
+    """
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = redact(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+def query_shape(command_name: str, command: Mapping[str, Any]) -> dict | None:
+    """Return the redacted query of a command, if it has one."""
+    if command_name in EXPLAINABLE_FIELDS:
+        return {
+            field: redact(command[field])
+            for field in EXPLAINABLE_FIELDS[command_name]
+            if field in command
+        }
+    if command_name in STATEMENT_FIELDS:
+        statements, fields = STATEMENT_FIELDS[command_name]
+        return {
+            statements: redact(
+                [
+                    {field: statement[field] for field in fields}
+                    for statement in command.get(statements, ())
+                ]
+            )
+        }
+    return None
+
+
+def collection_name(
+    command_name: str, command: Mapping[str, Any]
+) -> str | None:
+    name = command.get(
+        "collection" if command_name == "getMore" else command_name
+    )
+    return name if isinstance(name, str) else None
+
+
+def winning_plan_stages(explain: Any) -> Iterator[str]:
+    """Yield the stages of every winning plan found in an explain output."""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield from _plan_stages(value)
+            else:
+                yield from winning_plan_stages(value)
+    elif isinstance(explain, list):
+        for item in explain:
+            yield from winning_plan_stages(item)
+
+
+def _plan_stages(plan: Any) -> Iterator[str]:
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+class QueryMonitor(monitoring.CommandListener):
+    """
+    Records command latency and reports slow queries.
+
+    Commands slower than ``slow_query_ms`` are logged with their redacted
+    query shape. Once bound to a client, slow shapes are also explained,
+    at most once per ``explain_interval`` seconds each, and plans scanning
+    a whole collection are logged as warnings.
+
+    pymongo calls listeners from the threads running the commands, so
+    metrics and explains are handed over to the event loop the monitor was
+    bound on.
+    """
+
+    def __init__(
+        self,
+        slow_query_ms: float = settings.mongo_slow_query_ms,
+        explain_interval: float = settings.mongo_explain_interval,
+        max_shapes: int = settings.mongo_explain_max_shapes,
+    ) -> None:
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.explain_interval = explain_interval
+        self.client: AsyncIOMotorClient | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # Commands in flight, by connection and request id
+        self._started: dict[
+            tuple[Any, int], tuple[str, Mapping[str, Any]]
+        ] = {}
+        # Query shapes explained recently, only touched on the event loop
+        self._explained = TTLCache(maxsize=max_shapes, ttl=explain_interval)
+        self._explains: set[asyncio.Task] = set()
+
+    def bind(self, client: AsyncIOMotorClient) -> None:
+        """Explain slow queries with this client, on the running loop."""
+        self.client = client
+        self.loop = asyncio.get_running_loop()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = collection_name(event.command_name, event.command)
+        if collection is not None:
+            self._started[(event.connection_id, event.request_id)] = (
+                collection,
+                event.command,
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finished(event)
+
+    def _finished(
+        self,
+        event: monitoring.CommandSucceededEvent
+        | monitoring.CommandFailedEvent,
+    ) -> None:
+        started = self._started.pop(
+            (event.connection_id, event.request_id), None
+        )
+        if started is None:
+            return
+        collection, command = started
+        duration = event.duration_micros / 1_000_000
+        slow = duration >= self.slow_query_seconds
+        record_threadsafe(
+            self.loop,
+            self._record,
+            collection,
+            event.command_name,
+            duration,
+            slow,
+        )
+        if not slow:
+            return
+
+        shape = query_shape(event.command_name, command)
+        logger.warning(
+            "Slow MongoDB %s on %s.%s took %.1f ms: %s",
+            event.command_name,
+            event.database_name,
+            collection,
+            duration * 1000,
+            json.dumps(shape, default=str),
+        )
+        if (
+            self.loop is not None
+            and self.explain_interval > 0
+            and event.command_name in EXPLAINABLE_FIELDS
+        ):
+            self.loop.call_soon_threadsafe(
+                self._schedule_explain,
+                event.database_name,
+                collection,
+                event.command_name,
+                command,
+                shape,
+            )
+
+    @staticmethod
+    def _record(
+        collection: str, command_name: str, duration: float, slow: bool
+    ) -> None:
+        mongo_command_duration.observe(duration, collection, command_name)
+        if slow:
+            mongo_slow_commands.inc(collection, command_name)
+
+    def _schedule_explain(
+        self,
+        database: str,
+        collection: str,
+        command_name: str,
+        command: Mapping[str, Any],
+        shape: dict | None,
+    ) -> None:
+        key = (
+            database,
+            collection,
+            command_name,
+            json.dumps(shape, sort_keys=True, default=str),
+        )
+        if key in self._explained:
+            return
+        self._explained.set(key, True)
+        task = asyncio.ensure_future(
+            self.explain(database, collection, command, key[3])
+        )
+        # Keep a reference until the explain is done
+        self._explains.add(task)
+        task.add_done_callback(self._explains.discard)
+
+    async def explain(
+        self,
+        database: str,
+        collection: str,
+        command: Mapping[str, Any],
+        shape: str,
+    ) -> None:
+        """Explain a command and warn when its plan scans the collection."""
+        assert self.client is not None
+        explained = {
+            field: value
+            for field, value in command.items()
+            if field not in DRIVER_FIELDS
+        }
+        try:
+            explain = await self.client[database].command(
+                {"explain": explained, "verbosity": "queryPlanner"}
+            )
+        except Exception as e:
+            logger.error(
+                "Could not explain a slow query on %s.%s: %s",
+                database,
+                collection,
+                e,
+            )
+            return
+
+        stages = set(winning_plan_stages(explain))
+        if "COLLSCAN" in stages:
+            mongo_collection_scans.inc(collection)
+            logger.warning(
+                "Slow query on %s.%s scans the collection, consider an "
+                "index for: %s",
+                database,
+                collection,
+                shape,
+            )
+        else:
+            logger.info(
+                "Slow query on %s.%s uses %s: %s",
+                database,
+                collection,
+                ", ".join(sorted(stages)),
+                shape,
+            )
@@ -1,13 +1,31 @@
 from typing import Any
 
 import socketio
-
+from fastapi import HTTPException
+from socketio.exceptions import ConnectionRefusedError
+
+from chatApp.config.auth import verify_token
+from chatApp.config.cluster import (
+    ClusterState,
+    create_client_manager,
+    create_cluster_state,
+)
 from chatApp.config.config import get_settings
 from chatApp.config.logs import get_logger
 from chatApp.models import message as message_model
 from chatApp.models import private_room, public_room
 from chatApp.models import user as user_model
+from chatApp.services.metrics import observe_emit, registry, timed_event
+from chatApp.services.presence import (
+    CLIENT_COUNT_ROOM,
+    PresenceBroadcaster,
+    room_count_room,
+)
+from chatApp.utils.object_id import PydanticObjectId, is_valid_object_id
 
+logger = get_logger(__name__)
+# Per message and room events, sampled through ``log_sample_rates``
+event_logger = get_logger(f"{__name__}.events")
 settings = get_settings()
 
 # Define the Socket.IO server
@@ -15,6 +33,7 @@ sio_server = socketio.AsyncServer(
     async_mode="asgi",
     cors_allowed_origins=[],
     logger=get_logger("socket.io"),
+    client_manager=create_client_manager(),
 )
 
 # Create the ASGI app using the defined server
@@ -26,202 +45,340 @@ sio_app = socketio.ASGIApp(
 
 # Global state management
 class GlobalState:
-    all_clients: int = 0
-    rooms_client_count: dict[str, int] = {}
+    """Connection counts aggregated over every worker of the cluster."""
+
+    def __init__(self, backend: ClusterState) -> None:
+        self.backend = backend
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def stop(self) -> None:
+        # Takes this worker's clients out of the cluster counts
+        await self.backend.stop()
+
+    async def all_clients(self) -> int:
+        return await self.backend.get_clients()
+
+    async def rooms_client_count(self, room_id: str) -> int:
+        return await self.backend.get_room(room_id)
+
+    async def client_connected(self) -> int:
+        return await self.backend.incr_clients(1)
+
+    async def client_disconnected(self) -> int:
+        return await self.backend.incr_clients(-1)
+
+    async def room_joined(self, room_id: str) -> int:
+        return await self.backend.incr_room(room_id, 1)
+
+    async def room_left(self, room_id: str) -> int:
+        return await self.backend.incr_room(room_id, -1)
+
+
+global_state = GlobalState(create_cluster_state())
+
+connected_clients = registry.gauge(
+    "chat_connected_clients", "Clients connected to the cluster"
+)
+active_rooms = registry.gauge(
+    "chat_active_public_rooms", "Public rooms with connected clients"
+)
+
+
+async def collect_state_metrics() -> None:
+    connected_clients.set(await global_state.all_clients())
+    active_rooms.set(len(await global_state.backend.get_rooms()))
+
+
+registry.add_collector(collect_state_metrics)
+
+presence = PresenceBroadcaster(sio_server, global_state.backend)
 
 
-global_state = GlobalState()
+def get_token(environ: dict, auth: dict | None) -> str | None:
+    """
+    Extract the JWT access token of a connecting client.
+
+    The token is read from the socket.io ``auth`` payload, falling back to a
+    bearer ``Authorization`` header for clients that cannot send one.
+    """
+    if isinstance(auth, dict) and isinstance(auth.get("token"), str):
+        return auth["token"]
+
+    scheme, _, token = environ.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token
+    return None
+
+
+def get_room_id(data: Any) -> str | None:
+    room_id = data.get("room_id") if isinstance(data, dict) else None
+    if isinstance(room_id, str) and is_valid_object_id(room_id):
+        return room_id
+    return None
 
 
 @sio_server.event
-async def connect(sid: str, environ: dict, auth: dict) -> None:
-    """Handle a new client connection."""
-    global_state.all_clients += 1
-    print(f"Client connected: {sid}")
-    print(f"Number of clients connected: {global_state.all_clients}")
-    await sio_server.emit("client_count", data=global_state.all_clients)
+@timed_event
+async def connect(sid: str, environ: dict, auth: dict | None = None) -> None:
+    """
+    Handle a new client connection.
+
+    The client is authenticated once here and its session keeps the user and
+    the rooms it was authorized to join, so later events trust the session
+    instead of the event payload.
+    """
+    token = get_token(environ, auth)
+    if token is None:
+        raise ConnectionRefusedError("authentication required")
+
+    try:
+        payload = verify_token(token)
+    except HTTPException:
+        raise ConnectionRefusedError("invalid token") from None
+
+    user_id = payload.get("id")
+    user: user_model.UserProfile | None = (
+        await user_model.fetch_user_by_id(user_id)
+        if isinstance(user_id, str) and is_valid_object_id(user_id)
+        else None
+    )
+    if user is None or not user.is_active:
+        raise ConnectionRefusedError("invalid user")
+
+    await sio_server.save_session(
+        sid,
+        {
+            "user_id": str(user.id),
+            "username": user.username,
+            # room id -> room type, for the rooms this client was authorized
+            "rooms": {},
+        },
+    )
+
+    all_clients = await global_state.client_connected()
+    presence.mark_clients()
+    logger.info(
+        "Client %s connected as user %s, %d clients connected",
+        sid,
+        user.id,
+        all_clients,
+    )
 
 
 @sio_server.event
+@timed_event
 async def disconnect(sid: str) -> None:
     """Handle client disconnection."""
-    global_state.all_clients -= 1
-    print(f"Client disconnected: {sid}")
-    print(f"Number of clients connected: {global_state.all_clients}")
-    await sio_server.emit("client_count", data=global_state.all_clients)
+    session = await sio_server.get_session(sid)
+    if "user_id" not in session:
+        # The connection was refused before a session was created
+        return
+
+    for room_id, room_type in session["rooms"].items():
+        if room_type == "public":
+            await global_state.room_left(room_id)
+            presence.mark_room(room_id)
+
+    all_clients = await global_state.client_disconnected()
+    presence.mark_clients()
+    logger.info(
+        "Client %s disconnected, %d clients connected", sid, all_clients
+    )
 
 
 @sio_server.event
+@timed_event
 async def joining_public_room(sid: str, data: dict[str, Any]) -> None:
     """Handle user joining a public room."""
-    room_id = data.get("room_id")
-    user_id = data.get("user_id")
-
-    if not isinstance(room_id, str) or not isinstance(user_id, str):
-        await sio_server.emit(
-            "error", data="Invalid room_id or user_id", room=sid
-        )
+    room_id = get_room_id(data)
+    if room_id is None:
+        await sio_server.emit("error", data="Invalid room_id", room=sid)
         return
 
-    room_joined, report, _ = await public_room.join_public_room(
-        room_id, user_id
-    )
+    async with sio_server.session(sid) as session:
+        user_id: str = session["user_id"]
+        if room_id in session["rooms"]:
+            return
 
-    if room_joined:
-        await sio_server.enter_room(sid, room_id)
-        global_state.rooms_client_count[room_id] = (
-            global_state.rooms_client_count.get(room_id, 0) + 1
+        room_joined, report, _ = await public_room.join_public_room(
+            room_id, user_id
         )
-        room_members = global_state.rooms_client_count[room_id]
-        print(f"User {user_id} joined public room {room_id}")
-        print(f"Number of users in the room {room_id}: {room_members}")
-        await sio_server.emit("room_count", data=room_members, room=room_id)
-        await sio_server.emit("user_joined", data=user_id, room=room_id)
-    else:
-        await sio_server.emit("error", data="report", to=sid)
+        if not room_joined:
+            await sio_server.emit("error", data=report, to=sid)
+            return
+
+        session["rooms"][room_id] = "public"
+
+    await sio_server.enter_room(sid, room_id)
+    room_members = await global_state.room_joined(room_id)
+    presence.mark_room(room_id)
+    event_logger.info(
+        "User %s joined public room %s, %d users in the room",
+        user_id,
+        room_id,
+        room_members,
+    )
+    await sio_server.emit("user_joined", data=user_id, room=room_id)
+    observe_emit(sio_server, "user_joined", room_id)
 
 
 @sio_server.event
+@timed_event
 async def joining_private_room(sid: str, data: dict[str, Any]) -> None:
     """Handle user joining a private room."""
-    room_id: str = data["room_id"]
-    user_id: str = data["user_id"]
-
-    room: (
-        private_room.PrivateRoomInDB | None
-    ) = await private_room.fetch_private_room_by_id(room_id)
-    if room is None:
-        await sio_server.emit("error", data="Room not found", room=sid)
+    room_id = get_room_id(data)
+    if room_id is None:
+        await sio_server.emit("error", data="Invalid room_id", room=sid)
         return
 
-    user: user_model.UserInDB | None = await user_model.fetch_user_by_id(
-        user_id
-    )
-    if user is None:
-        await sio_server.emit("error", data="User not found", room=sid)
-        return
+    async with sio_server.session(sid) as session:
+        user_id: str = session["user_id"]
+        if room_id in session["rooms"]:
+            return
 
-    access: bool = await private_room.check_user_in_private_room(
-        room_id, user_id
-    )
-    if access:
-        await sio_server.enter_room(sid, room_id)
-        await sio_server.emit("user_joined", data=user_id, room=room_id)
-    else:
-        await sio_server.emit("error", data="Access denied", room=sid)
-        return
+        membership = await private_room.membership_index.get(
+            PydanticObjectId(room_id)
+        )
+        if membership is None:
+            await sio_server.emit("error", data="Room not found", room=sid)
+            return
+
+        if not membership.is_member(PydanticObjectId(user_id)):
+            await sio_server.emit("error", data="Access denied", room=sid)
+            return
+
+        session["rooms"][room_id] = "private"
+
+    await sio_server.enter_room(sid, room_id)
+    await sio_server.emit("user_joined", data=user_id, room=room_id)
+    observe_emit(sio_server, "user_joined", room_id)
 
 
 @sio_server.event
+@timed_event
 async def leave_room(sid: str, data: dict[str, Any]) -> None:
     """Handle user leaving a room."""
-    room_id = data.get("room_id")
-    user_id = data.get("user_id")
+    room_id = get_room_id(data)
+    if room_id is None:
+        await sio_server.emit("error", data="Invalid room_id", room=sid)
+        return
 
-    if not isinstance(room_id, str) or not isinstance(user_id, str):
-        await sio_server.emit(
-            "error", data="Invalid room_id or user_id", room=sid
-        )
+    async with sio_server.session(sid) as session:
+        user_id: str = session["user_id"]
+        room_type = session["rooms"].pop(room_id, None)
+    if room_type is None:
         return
 
     await sio_server.leave_room(sid, room_id)
-    global_state.rooms_client_count[room_id] = max(
-        global_state.rooms_client_count.get(room_id, 0) - 1, 0
-    )
-    room_members = global_state.rooms_client_count[room_id]
-    print(f"User {user_id} left room {room_id}")
-    print(f"Number of users in the room {room_id}: {room_members}")
-    await sio_server.emit("room_count", data=room_members, room=room_id)
+    await sio_server.leave_room(sid, room_count_room(room_id))
+    if room_type == "public":
+        room_members = await global_state.room_left(room_id)
+        presence.mark_room(room_id)
+        event_logger.info("%d users in the room %s", room_members, room_id)
+    event_logger.info("User %s left room %s", user_id, room_id)
     await sio_server.emit("user_left", data=user_id, room=room_id)
+    observe_emit(sio_server, "user_left", room_id)
 
 
 @sio_server.event
-async def send_public_message(sid: str, data: dict[str, Any]) -> None:
-    """Handle sending a message to a public group."""
-    room_id: str = data["room_id"]
-    message_sent: str = data["message"]
-    user_id: str = data["user_id"]
-
-    print(
-        f"Sending message to room {room_id}: {message_sent} from user {user_id}"
-    )
-
-    room = await public_room.fetch_public_room_by_id(room_id)
-
-    if not room:
+@timed_event
+async def subscribe_counts(sid: str, data: dict[str, Any] | None) -> None:
+    """
+    Subscribe to count updates.
+
+    Without a room_id the client receives ``client_count`` updates, with the
+    id of a joined public room it receives that room's ``room_count``. The
+    current value is sent right away, later ones once per presence tick.
+    """
+    if not data or isinstance(data, dict) and data.get("room_id") is None:
+        await sio_server.enter_room(sid, CLIENT_COUNT_ROOM)
         await sio_server.emit(
-            "error", data={"error": "Room not found"}, room=sid
+            "client_count", data=await global_state.all_clients(), to=sid
         )
         return
 
-    user: user_model.UserInDB | None = await user_model.fetch_user_by_id(
-        user_id
-    )
-    if user is None:
+    room_id = get_room_id(data)
+    session = await sio_server.get_session(sid)
+    if room_id is None or session["rooms"].get(room_id) != "public":
         await sio_server.emit(
-            "error", data={"error": "User not found"}, room=sid
+            "error", data="You have not joined this room", room=sid
         )
         return
 
-    if public_room.check_user_in_public_room(room_id, user_id):
-        new_message = await message_model.create_message(
-            room_id, user_id, "public", message_sent
-        )
+    await sio_server.enter_room(sid, room_count_room(room_id))
+    await sio_server.emit(
+        "room_count",
+        data=await global_state.rooms_client_count(room_id),
+        to=sid,
+    )
 
-        await sio_server.emit(
-            event="message",
-            data={
-                "sid": sid,
-                "message": new_message.content,
-                "user_id": user_id,
-            },
-            room=room_id,
-        )
 
-        print(f"Message sent to room {room_id}: {new_message.content}")
+@sio_server.event
+@timed_event
+async def unsubscribe_counts(sid: str, data: dict[str, Any] | None) -> None:
+    """Stop receiving the count updates subscribed with subscribe_counts."""
+    room_id = get_room_id(data)
+    if room_id is None:
+        await sio_server.leave_room(sid, CLIENT_COUNT_ROOM)
     else:
-        print("User is not a member of the room or user not found")
+        await sio_server.leave_room(sid, room_count_room(room_id))
 
 
-@sio_server.event
-async def send_private_message(sid: str, data: dict[str, Any]) -> None:
-    """Handle sending a private message."""
-    room_id: str = data["room_id"]
-    user_id: str = data["user_id"]
-    message_sent: str = data["message"]
-
-    room: (
-        private_room.PrivateRoomInDB | None
-    ) = await private_room.fetch_private_room_by_id(room_id)
-    if room is None:
+async def send_message(sid: str, data: dict[str, Any], room_type: str) -> None:
+    """
+    Store a message from a client and broadcast it to the room.
+
+    Only rooms recorded in the client session are accepted, so no user or
+    room lookups are needed before the message is inserted.
+    """
+    room_id = get_room_id(data)
+    message_sent = data.get("message") if isinstance(data, dict) else None
+    if room_id is None or not isinstance(message_sent, str):
         await sio_server.emit(
-            "error", data={"error": "Room not found"}, room=sid
+            "error", data={"error": "Invalid room_id or message"}, room=sid
         )
         return
-    user: user_model.UserInDB | None = await user_model.fetch_user_by_id(
-        user_id
-    )
-    if user is None:
+
+    session = await sio_server.get_session(sid)
+    user_id: str = session["user_id"]
+    if session["rooms"].get(room_id) != room_type:
         await sio_server.emit(
-            "error", data={"error": "Users not found"}, room=sid
+            "error", data={"error": "You have not joined this room"}, room=sid
         )
         return
 
     new_message: message_model.MessageInDB = (
         await message_model.create_message(
-            room_id, user_id, "private", message_sent
+            room_id, user_id, room_type, message_sent, verify_room=False
         )
     )
     await sio_server.emit(
         "message",
         {
             "sid": sid,
-            "message": message_sent,
+            "message": new_message.content,
             "message_id": str(new_message.id),
             "user_id": user_id,
         },
         room=room_id,
     )
-    print(
-        f"Private message sent from {user_id} to room {room_id}: {message_sent}"
+    observe_emit(sio_server, "message", room_id)
+    event_logger.info(
+        "Message sent from %s to %s room %s", user_id, room_type, room_id
     )
+
+
+@sio_server.event
+@timed_event
+async def send_public_message(sid: str, data: dict[str, Any]) -> None:
+    """Handle sending a message to a public group."""
+    await send_message(sid, data, "public")
+
+
+@sio_server.event
+@timed_event
+async def send_private_message(sid: str, data: dict[str, Any]) -> None:
+    """Handle sending a private message."""
+    await send_message(sid, data, "private")
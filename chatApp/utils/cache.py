@@ -0,0 +1,253 @@
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Generic, TypeVar
+
+from pydantic import BaseModel
+
+from chatApp.config.cluster import get_redis, is_redis_url
+from chatApp.config.config import get_settings
+from chatApp.utils.singleflight import SingleFlight
+
+settings = get_settings()
+
+V = TypeVar("V")
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with a time to live per entry.
+
+    Entries expire ``ttl`` seconds after they were set, and the least
+    recently used entry is evicted once ``maxsize`` is reached.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """
+        Store a value.
+
+        :param ttl: Time to live of this entry, defaults to the cache ttl.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_MISSING = object()
+
+
+# Values of the request being handled, keyed by cache name and key. None
+# outside of a request scope.
+_request_values: ContextVar[dict[tuple[str, Hashable], Any] | None] = (
+    ContextVar("request_values", default=None)
+)
+
+
+@contextmanager
+def request_scope() -> Iterator[None]:
+    """
+    Memoize read-through cache lookups until the block exits.
+
+    Lookups repeated within one request return the value of the first one,
+    without going back to the cache backend.
+    """
+    token = _request_values.set({})
+    try:
+        yield
+    finally:
+        _request_values.reset(token)
+
+
+class LocalCacheBackend:
+    """Per worker LRU cache with a time to live per entry."""
+
+    def __init__(self, maxsize: int) -> None:
+        self._cache = TTLCache(maxsize=maxsize, ttl=0)
+
+    async def get(self, key: str) -> Any:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key)
+
+
+class RedisCacheBackend:
+    """
+    Cache shared by every worker in a redis instance.
+
+    Stores the one-tuple entries of a read-through cache, with the model
+    as JSON or ``null`` for negative entries. Models are dumped by field
+    name, so the cached model must accept field names.
+    """
+
+    def __init__(self, url: str, prefix: str, model: type[BaseModel]) -> None:
+        self.redis = get_redis(url)
+        self.prefix = prefix
+        self.model = model
+
+    async def get(self, key: str) -> Any:
+        value = await self.redis.get(f"{self.prefix}:cache:{key}")
+        if value is None:
+            return None
+        if value == b"null":
+            return (None,)
+        return (self.model.model_validate_json(value),)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.redis.set(
+            f"{self.prefix}:cache:{key}",
+            value[0].model_dump_json() if value[0] is not None else "null",
+            px=max(int(ttl * 1000), 1),
+        )
+
+    async def delete(self, key: str) -> None:
+        await self.redis.delete(f"{self.prefix}:cache:{key}")
+
+
+CacheBackend = LocalCacheBackend | RedisCacheBackend
+
+
+def create_cache_backend(
+    maxsize: int,
+    model: type[BaseModel] | None = None,
+    url: str | None = None,
+) -> CacheBackend:
+    """
+    Build the backend of a read-through cache.
+
+    :param maxsize: Maximum number of entries of a per worker cache.
+    :param model: The model of the cached values, required by redis.
+    :param url: The redis URL, defaults to ``cache_url``.
+    :return: A redis backed cache for redis URLs, otherwise a per worker
+        one.
+    :raises ValueError: If a redis URL is configured without a model.
+    """
+    url = url or settings.cache_url
+    if not is_redis_url(url):
+        return LocalCacheBackend(maxsize)
+    if model is None:
+        raise ValueError("A shared cache needs the model of its values")
+    return RedisCacheBackend(url, settings.cluster_state_prefix, model)
+
+
+class ReadThroughCache(Generic[V]):
+    """
+    Async read-through cache in front of a loader.
+
+    Keys the loader finds nothing for are cached as well, for
+    ``negative_ttl`` seconds, so lookups of unknown ids don't reach the
+    database every time. Concurrent misses of a key share a single load.
+    Lookups inside a :func:`request_scope` are
+    memoized for the rest of the request. A redis backed cache stores
+    values as JSON, which needs ``model``, the pydantic model of the values.
+
+    Writers must call :meth:`invalidate` after changing an entity.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[str], Awaitable[V | None]],
+        ttl: float,
+        negative_ttl: float = settings.cache_negative_ttl,
+        backend: CacheBackend | None = None,
+        maxsize: int = 10000,
+        model: type[BaseModel] | None = None,
+    ) -> None:
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend or create_cache_backend(maxsize, model)
+        # Concurrent misses of a key share one load
+        self._loads: SingleFlight[V | None] = SingleFlight(name)
+        # Keys with loads in flight: the invalidation generation and the
+        # number of loads
+        self._pending: dict[str, list[int]] = {}
+
+    async def get(self, key: str) -> V | None:
+        key = str(key)
+        values = _request_values.get()
+        if values is not None and (self.name, key) in values:
+            return values[(self.name, key)]
+
+        # Entries are wrapped in a tuple, so a cached None is a negative
+        # entry and a missing entry is None
+        entry = await self.backend.get(f"{self.name}:{key}")
+        if entry is None:
+            value = await self._loads.do(key, lambda: self._load(key))
+        else:
+            value = entry[0]
+
+        if values is not None:
+            values[(self.name, key)] = value
+        return value
+
+    async def _load(self, key: str) -> V | None:
+        pending = self._pending.setdefault(key, [0, 0])
+        generation = pending[0]
+        pending[1] += 1
+        try:
+            value = await self.loader(key)
+            # A load invalidated while it ran may have read the old value,
+            # it is returned to its callers but never cached
+            if pending[0] == generation:
+                await self.backend.set(
+                    f"{self.name}:{key}",
+                    (value,),
+                    self.ttl if value is not None else self.negative_ttl,
+                )
+        finally:
+            pending[1] -= 1
+            if not pending[1]:
+                del self._pending[key]
+        return value
+
+    async def invalidate(self, key: str) -> None:
+        """Drop an entry, call after every write to the entity."""
+        key = str(key)
+        # Loads started before the write may return the old value, new
+        # callers start their own and the old ones won't be cached
+        self._loads.forget(key)
+        if key in self._pending:
+            self._pending[key][0] += 1
+        await self.backend.delete(f"{self.name}:{key}")
+        values = _request_values.get()
+        if values is not None:
+            values.pop((self.name, key), None)
@@ -5,3 +5,9 @@ credentials_exception = HTTPException(
     detail="Could not validate credentials",
     headers={"WWW-Authenticate": "Bearer"},
 )
+
+password_pool_saturated_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many password checks in progress, retry shortly",
+    headers={"Retry-After": "1"},
+)
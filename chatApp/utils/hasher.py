@@ -1,7 +1,15 @@
+import asyncio
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 
 from chatApp.config.config import get_settings
+from chatApp.services.metrics import registry
+from chatApp.utils.exceptions import password_pool_saturated_exception
 
 settings = get_settings()
 
@@ -12,22 +20,102 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+T = TypeVar("T")
+
+
+password_hash_queue_wait = registry.histogram(
+    "password_hash_queue_wait_seconds",
+    "Time password hashing jobs waited for a pool thread",
+)
+password_hash_rejected = registry.counter(
+    "password_hash_rejected_total",
+    "Password hashing jobs refused because the pool was saturated",
+)
+password_hash_pending = registry.gauge(
+    "password_hash_pending", "Password hashing jobs waiting or running"
+)
+
+
+class PasswordPool:
+    """
+    Bounded thread pool for password hashing.
+
+    bcrypt takes tens to hundreds of milliseconds of CPU and releases the
+    GIL while it runs, so it is done off the event loop. At most
+    ``max_pending`` jobs may wait or run at once, further ones are refused
+    with a 503 instead of queueing without limit during login bursts.
+    Metrics are only recorded on the event loop, the worker threads just
+    measure their queue wait.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = settings.password_hash_workers,
+        max_pending: int = settings.password_hash_max_pending,
+    ) -> None:
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password"
+        )
+        self.pending = 0
+
+    async def run(self, fn: Callable[..., T], *args: object) -> T:
+        """
+        Run a function in the pool.
+
+        :raises HTTPException: 503 if ``max_pending`` jobs are in progress.
+        """
+        if self.pending >= self.max_pending:
+            password_hash_rejected.inc()
+            raise password_pool_saturated_exception
+
+        submitted_at = time.perf_counter()
+
+        def job() -> tuple[float, T]:
+            # Time spent queued behind other jobs, measured in the worker
+            waited = time.perf_counter() - submitted_at
+            return waited, fn(*args)
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            waited, result = await loop.run_in_executor(self._executor, job)
+        finally:
+            self.pending -= 1
+        password_hash_queue_wait.observe(waited)
+        return result
+
+
+password_pool = PasswordPool()
+
+
+async def collect_password_pool_metrics() -> None:
+    password_hash_pending.set(password_pool.pending)
+
+
+registry.add_collector(collect_password_pool_metrics)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify if the provided password matches the stored hashed password.
 
     :param plain_password: The plain text password.
     :param hashed_password: The hashed password stored in the database.
     :return: True if passwords match, otherwise False.
+    :raises HTTPException: 503 if the password pool is saturated.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return await password_pool.run(
+        pwd_context.verify, plain_password, hashed_password
+    )
 
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """
     Hash the given password using the password hashing context.
 
     :param password: The plain text password to hash.
     :return: The hashed password.
+    :raises HTTPException: 503 if the password pool is saturated.
     """
-    return pwd_context.hash(password)
+    return await password_pool.run(pwd_context.hash, password)
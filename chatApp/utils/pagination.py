@@ -0,0 +1,35 @@
+import base64
+import binascii
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def encode_cursor(created_at: datetime, id: ObjectId) -> str:
+    """
+    Encode a keyset position into an opaque cursor token.
+
+    :param created_at: The creation time of the last returned item.
+    :param id: The ID of the last returned item, used as a tie breaker.
+    :return: The URL safe cursor token.
+    """
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """
+    Decode a cursor token created by encode_cursor.
+
+    :param cursor: The cursor token.
+    :return: The creation time and ID the cursor points at.
+    :raises ValueError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at, _, id = raw.partition("|")
+        return datetime.fromisoformat(created_at), ObjectId(id)
+    except (binascii.Error, UnicodeDecodeError, InvalidId, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}") from None
@@ -0,0 +1,50 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+from chatApp.services.metrics import singleflight_calls
+
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[V]):
+    """
+    Share one in-flight call between concurrent callers of the same key.
+
+    The first caller of a key starts the call, callers arriving before it
+    completes await the same result, or exception, instead of starting
+    their own. The call runs in a task of its own, so a cancelled caller
+    doesn't cancel it for the others.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Future[V]] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[V]]) -> V:
+        call = self._calls.get(key)
+        if call is None:
+            singleflight_calls.inc(self.name, "leader")
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            singleflight_calls.inc(self.name, "shared")
+        return await asyncio.shield(call)
+
+    def forget(self, key: Hashable) -> None:
+        """
+        Let the next caller of a key start a new call.
+
+        The forgotten call keeps running and its callers still get its
+        result, so callers must not let it publish a value that is stale by
+        now, see ``ReadThroughCache`` for a generation check.
+        """
+        self._calls.pop(key, None)
+
+    def _forget(self, key: Hashable, call: asyncio.Future[V]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Retrieve the exception, every caller may have been cancelled
+        if not call.cancelled():
+            call.exception()
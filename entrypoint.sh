@@ -2,5 +2,21 @@
 set -e
 
 RUN_PORT=${RUN_PORT:-8000}
+# More than one worker needs SOCKETIO_MESSAGE_QUEUE so the workers share
+# rooms, and clients should use the websocket transport since uvicorn
+# workers are not sticky for long-polling.
+WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
 
-exec uvicorn chatApp.main:app --host 0.0.0.0 --port ${RUN_PORT}
+# --migrate applies the pending schema migrations and exits, it runs
+# python -m chatApp.config.migrations.
+# --skip-bootstrap starts the workers without checking the schema version,
+# for deployments that migrate the database out of band with --migrate.
+if [ "$1" = "--migrate" ]; then
+    exec python -m chatApp.config.migrations
+fi
+if [ "$1" = "--skip-bootstrap" ]; then
+    export SCHEMA_BOOTSTRAP=false
+fi
+
+exec uvicorn chatApp.main:app --host 0.0.0.0 --port ${RUN_PORT} \
+    --workers ${WEB_CONCURRENCY}
@@ -1,28 +1,32 @@
 const ROOM_ID = "66a7731a11fe8199049c8dbd"; // put your room ID here
-const USER1_ID = "66a765df185ba34c8e4a4b1a"; // put your user ID here
+const ACCESS_TOKEN = ""; // put the access token from /auth/token here
 const PRV_ROOM_ID = "66a785f6473ff39a7496f918"; // put your private room id to send message
 
 // Establish the Socket.IO connection
 const sio = io("http://127.0.0.1:8000/", {
   path: "/socket.io",
-  transports: ['websocket', 'polling']
+  transports: ['websocket', 'polling'],
+  auth: { token: ACCESS_TOKEN }
 });
 
 // Handle connection event
 sio.on("connect", () => {
   console.log("Connected to the server with SID:", sio.id);
 
+  // Receive client_count updates, pass a room_id for a joined room's room_count
+  // sio.emit('subscribe_counts', {});
+
   // Emit the 'join_room' event for a public room
-  // sio.emit('joining_public_room', { room_id: ROOM_ID, user_id: USER1_ID });
+  // sio.emit('joining_public_room', { room_id: ROOM_ID });
 
   // Send a public message
-  // sio.emit('send_public_message', { room_id: ROOM_ID, message: "Hello, world JS!", user_id: USER1_ID });
+  // sio.emit('send_public_message', { room_id: ROOM_ID, message: "Hello, world JS!" });
 
   // emit the join_room event for a private room
-  // sio.emit('joining_private_room', {room_id: PRV_ROOM_ID, user_id: USER1_ID});
+  // sio.emit('joining_private_room', {room_id: PRV_ROOM_ID});
 
   // Send a private message
-  // sio.emit('send_private_message', {room_id: PRV_ROOM_ID, user_id: USER1_ID, message: "hello private!"});
+  // sio.emit('send_private_message', {room_id: PRV_ROOM_ID, message: "hello private!"});
 });
 
 // Handle disconnection event
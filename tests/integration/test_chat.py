@@ -3,12 +3,36 @@
 import asyncio
 
 import pytest
+import requests
 import socketio
 
+BASE_URL = "http://127.0.0.1:8000"
+
+TEST_USER = {
+    "username": "socket_test_user",
+    "email": "socket_test@test.com",
+    "password": "test_password",
+}
+
 # Create a new Socket.IO client
 sio = socketio.AsyncClient()
 
 
+def get_access_token() -> str:
+    # Registering fails once the user exists, which is fine
+    requests.post(f"{BASE_URL}/auth/register", json=TEST_USER, timeout=10)
+    response = requests.post(
+        f"{BASE_URL}/auth/token",
+        data={
+            "username": TEST_USER["username"],
+            "password": TEST_USER["password"],
+        },
+        timeout=10,
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
 @pytest.mark.asyncio
 async def test_connection():
     # Define a flag to determine if the connection is successful
@@ -32,7 +56,9 @@ async def test_connection():
     try:
         # Connect to the server
         await sio.connect(
-            "ws://127.0.0.1:8000/socket.io/", wait_timeout=10
+            "ws://127.0.0.1:8000/socket.io/",
+            auth={"token": get_access_token()},
+            wait_timeout=10,
         )  # Ensure correct path
 
         # Wait for the connect event to be triggered
@@ -45,3 +71,13 @@ async def test_connection():
     finally:
         # Disconnect from the server
         await sio.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_connection_without_token_is_refused():
+    client = socketio.AsyncClient()
+
+    with pytest.raises(socketio.exceptions.ConnectionError):
+        await client.connect("ws://127.0.0.1:8000/socket.io/", wait_timeout=10)
+
+    await client.disconnect()
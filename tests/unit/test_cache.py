@@ -0,0 +1,61 @@
+import asyncio
+
+from chatApp.utils.cache import LocalCacheBackend, ReadThroughCache
+
+
+class Store:
+    """A loader over a dict whose first read can be held back."""
+
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+        self.loads = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def load(self, key: str) -> str | None:
+        self.loads += 1
+        value = self.values.get(key)
+        if self.loads == 1:
+            self.started.set()
+            await self.release.wait()
+        return value
+
+
+def create_cache(store: Store) -> ReadThroughCache[str]:
+    return ReadThroughCache(
+        "test", store.load, ttl=60, backend=LocalCacheBackend(100)
+    )
+
+
+async def test_loads_are_cached():
+    store = Store()
+    store.values["a"] = "one"
+    cache = create_cache(store)
+
+    assert await cache.get("a") == "one"
+    assert await cache.get("a") == "one"
+    assert await cache.get("missing") is None
+    assert await cache.get("missing") is None
+    assert store.loads == 2
+
+
+async def test_load_invalidated_while_running_is_not_cached():
+    store = Store()
+    store.values["a"] = "old"
+    cache = create_cache(store)
+
+    store.release.clear()
+    stale = asyncio.create_task(cache.get("a"))
+    await store.started.wait()
+    store.values["a"] = "new"
+    await cache.invalidate("a")
+
+    # A caller after the write starts its own load
+    assert await cache.get("a") == "new"
+
+    # The orphaned load finishing last doesn't replace the fresh entry
+    store.release.set()
+    assert await stale == "old"
+    assert await cache.get("a") == "new"
+    assert store.loads == 2
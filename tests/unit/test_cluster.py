@@ -0,0 +1,69 @@
+import asyncio
+from unittest import mock
+
+import socketio
+
+from chatApp.config.cluster import LocalPubSubManager, create_client_manager
+
+
+def create_server(channel: str) -> socketio.AsyncServer:
+    server = socketio.AsyncServer(
+        async_mode="asgi",
+        client_manager=LocalPubSubManager(channel=channel),
+    )
+    server._send_eio_packet = mock.AsyncMock()
+    server.manager_initialized = True
+    server.manager.initialize()
+    return server
+
+
+async def connect_client(
+    server: socketio.AsyncServer, eio_sid: str, room: str
+) -> str:
+    sid = await server.manager.connect(eio_sid, "/")
+    await server.enter_room(sid, room)
+    return sid
+
+
+def sent_events(server: socketio.AsyncServer) -> list[tuple[str, str]]:
+    """Return the (eio sid, event name) of the packets a server sent."""
+    return [
+        (
+            call.args[0],
+            socketio.packet.Packet(encoded_packet=call.args[1].data).data[0],
+        )
+        for call in server._send_eio_packet.call_args_list
+    ]
+
+
+async def test_emit_reaches_clients_of_other_servers():
+    server_a = create_server("test_emit")
+    server_b = create_server("test_emit")
+    # Let both listeners subscribe
+    await asyncio.sleep(0)
+    await connect_client(server_a, "eio_a", "room")
+    await connect_client(server_b, "eio_b", "room")
+    await connect_client(server_b, "eio_other", "other_room")
+
+    await server_a.emit("message", {"content": "hi"}, room="room")
+    await asyncio.sleep(0.01)
+
+    assert sent_events(server_a) == [("eio_a", "message")]
+    assert sent_events(server_b) == [("eio_b", "message")]
+
+
+async def test_channels_are_isolated():
+    server_a = create_server("test_isolated_a")
+    server_b = create_server("test_isolated_b")
+    await asyncio.sleep(0)
+    await connect_client(server_b, "eio_b", "room")
+
+    await server_a.emit("message", {"content": "hi"}, room="room")
+    await asyncio.sleep(0.01)
+
+    assert sent_events(server_b) == []
+
+
+def test_create_client_manager():
+    assert isinstance(create_client_manager("memory://"), LocalPubSubManager)
+    assert type(create_client_manager("")) is socketio.AsyncManager
@@ -0,0 +1,172 @@
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from chatApp.models.message import MessageInDB
+from chatApp.models.recent_messages import (
+    Position,
+    RecentMessagesCache,
+    RoomBuffer,
+)
+from chatApp.utils.pagination import encode_cursor
+
+ROOM_ID = ObjectId()
+START = datetime(2024, 1, 1)
+
+
+def create_message(created_at: datetime) -> MessageInDB:
+    return MessageInDB(
+        _id=ObjectId(),
+        user_id=ObjectId(),
+        room_id=ROOM_ID,
+        room_type="public",
+        content="message",
+        created_at=created_at,
+    )
+
+
+# Oldest first, with messages sharing a timestamp to exercise the _id
+# tie breaker
+HISTORY = [
+    create_message(START + timedelta(milliseconds=offset))
+    for offset in (0, 1, 1, 2, 3, 3, 3, 4, 5, 6, 6, 7)
+]
+
+
+def key(message: MessageInDB) -> tuple[datetime, ObjectId]:
+    return message.created_at, message.id
+
+
+def matches(message: MessageInDB, position: Position, operator: str) -> bool:
+    """Evaluate the keyset filter of the history query on a message."""
+    created_at, id = position
+    if id is None:
+        return {
+            "$lt": message.created_at < created_at,
+            "$gt": message.created_at > created_at,
+        }[operator]
+    return {
+        "$lt": key(message) < (created_at, id),
+        "$gt": key(message) > (created_at, id),
+        "$gte": key(message) >= (created_at, id),
+    }[operator]
+
+
+def query_page(
+    limit: int,
+    before: Position | None,
+    after: Position | None,
+    lower_bound: Position | None,
+) -> tuple[list[MessageInDB], str | None]:
+    """The page the history query returns for the whole room."""
+    messages = [
+        message
+        for message in HISTORY
+        if (lower_bound is None or matches(message, lower_bound, "$gte"))
+        and (before is None or matches(message, before, "$lt"))
+        and (after is None or matches(message, after, "$gt"))
+    ]
+    if after is None:
+        messages = sorted(messages, key=key, reverse=True)[:limit]
+    else:
+        messages = sorted(messages, key=key)[:limit]
+
+    next_cursor = None
+    if len(messages) == limit:
+        next_cursor = encode_cursor(*key(messages[-1]))
+    if after is not None:
+        messages.reverse()
+    return messages, next_cursor
+
+
+def create_buffer(size: int) -> RoomBuffer:
+    buffer = RoomBuffer(size or 1)
+    for message in HISTORY[len(HISTORY) - size :]:
+        buffer.append(message)
+    buffer.complete = size == len(HISTORY)
+    return buffer
+
+
+POSITIONS: list[Position] = [
+    (START - timedelta(milliseconds=1), None),
+    (START + timedelta(milliseconds=10), None),
+    *(key(message) for message in HISTORY),
+    *((message.created_at, None) for message in HISTORY),
+]
+LOWER_BOUNDS: list[Position | None] = [
+    None,
+    *(key(message) for message in HISTORY),
+]
+
+
+@pytest.mark.parametrize("size", [0, 1, 5, len(HISTORY)])
+@pytest.mark.parametrize("limit", [1, 3, 20])
+def test_read_matches_the_history_query(size, limit):
+    buffer = create_buffer(size)
+    served = 0
+    cases = itertools.chain(
+        ((None, None, bound) for bound in LOWER_BOUNDS),
+        (
+            (position, None, bound)
+            for position, bound in itertools.product(POSITIONS, LOWER_BOUNDS)
+        ),
+        (
+            (None, position, bound)
+            for position, bound in itertools.product(POSITIONS, LOWER_BOUNDS)
+        ),
+    )
+    for before, after, lower_bound in cases:
+        page = RecentMessagesCache._read(
+            buffer, limit, before, after, lower_bound
+        )
+        if page is None:
+            assert not buffer.complete
+            continue
+        served += 1
+        assert page == query_page(limit, before, after, lower_bound), (
+            before,
+            after,
+            lower_bound,
+        )
+    if size:
+        assert served
+
+
+def test_read_without_a_bound_needs_the_whole_page():
+    buffer = create_buffer(5)
+
+    page = RecentMessagesCache._read(buffer, 5, None, None, None)
+    assert page is not None
+    assert page[0] == HISTORY[:-6:-1]
+
+    # The sixth latest message is not buffered
+    assert RecentMessagesCache._read(buffer, 6, None, None, None) is None
+
+
+def test_seed_skipped_when_a_message_arrives_during_the_read():
+    cache = RecentMessagesCache(enabled=True)
+    generation = cache.begin_read(ROOM_ID)
+    assert generation is not None
+    message = create_message(START + timedelta(seconds=1))
+    cache.append(message)
+    cache.seed(ROOM_ID, HISTORY[::-1], complete=True, generation=generation)
+    cache.end_read(ROOM_ID)
+
+    assert cache.get_page(ROOM_ID, 20) is None
+
+
+def test_no_seed_while_messages_are_unwritten():
+    cache = RecentMessagesCache(enabled=True)
+    message = create_message(START + timedelta(seconds=1))
+    cache.append(message)
+    assert cache.begin_read(ROOM_ID) is None
+
+    cache.written(ROOM_ID, message.id)
+    generation = cache.begin_read(ROOM_ID)
+    assert generation is not None
+    cache.seed(ROOM_ID, HISTORY[::-1], complete=True, generation=generation)
+    cache.end_read(ROOM_ID)
+
+    assert cache.get_page(ROOM_ID, 20) == (HISTORY[::-1], None)
@@ -0,0 +1,43 @@
+import asyncio
+
+from chatApp.utils.singleflight import SingleFlight
+
+
+async def test_concurrent_callers_share_a_call():
+    flight: SingleFlight[int] = SingleFlight("test")
+    calls = 0
+    release = asyncio.Event()
+
+    async def fn() -> int:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    first = asyncio.create_task(flight.do("key", fn))
+    second = asyncio.create_task(flight.do("key", fn))
+    await asyncio.sleep(0)
+    release.set()
+    assert await first == await second == 1
+    assert calls == 1
+
+
+async def test_forget_starts_a_new_call():
+    flight: SingleFlight[str] = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def old() -> str:
+        await release.wait()
+        return "old"
+
+    async def new() -> str:
+        return "new"
+
+    orphan = asyncio.create_task(flight.do("key", old))
+    await asyncio.sleep(0)
+    flight.forget("key")
+    assert await flight.do("key", new) == "new"
+
+    # The forgotten call still completes for its callers
+    release.set()
+    assert await orphan == "old"